@@ -1,127 +1,487 @@
 import os
 import json
+import atexit
 import sqlite3
+import time
+import queue
 import hashlib
-from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+import functools
+import itertools
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to stdlib json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional; retrieved_sources is stored as JSON text instead
+    msgpack = None
+
+
+def _json_dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value)
+
+
+def _json_loads(raw: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _pack_sources(sources: List[str]) -> Any:
+    """Serialize retrieved_sources: a msgpack BLOB when available, else JSON text."""
+    if msgpack is not None:
+        return msgpack.packb(sources)
+    return _json_dumps(sources)
+
+
+def _unpack_sources(raw: Any) -> Any:
+    # BLOB rows were written with msgpack; TEXT rows are JSON (older rows or no msgpack installed)
+    if isinstance(raw, bytes):
+        return msgpack.unpackb(raw) if msgpack is not None else raw
+    return _json_loads(raw)
 
 _DB_PATH: Optional[str] = None
 
+# One long-lived connection per thread; PRAGMAs are applied once when it is opened
+_LOCAL = threading.local()
+_OPEN_CONNS: List[sqlite3.Connection] = []
+_OPEN_CONNS_LOCK = threading.Lock()
+# Planner statistics are refreshed periodically on a background thread and again at exit
+_OPTIMIZE_INTERVAL_S = 3600
+_OPTIMIZER: Optional[threading.Thread] = None
+_CONN_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-64000;",
+    "PRAGMA mmap_size=2147483648;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA foreign_keys=ON;",
+)
+
+# SQL text is kept in module constants so the per-connection statement cache keys stay stable
+_UPSERT_SESSION_SQL = """
+    INSERT INTO sessions (
+        session_id, visitor_id, created_at, updated_at, ip_hash, ip_plain, user_agent, locale, timezone, referrer, page_url, dnt,
+        net_effective_type, net_downlink, net_rtt, net_save_data, device_memory,
+        geo_country, geo_region, geo_city, geo_lat, geo_lon, geo_timezone, net_asn, net_org, net_isp
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(session_id) DO UPDATE
+    SET updated_at=excluded.updated_at, visitor_id=COALESCE(excluded.visitor_id, visitor_id),
+        ip_hash=COALESCE(excluded.ip_hash, ip_hash), ip_plain=COALESCE(excluded.ip_plain, ip_plain),
+        user_agent=COALESCE(excluded.user_agent, user_agent), locale=COALESCE(excluded.locale, locale),
+        timezone=COALESCE(excluded.timezone, timezone), referrer=COALESCE(excluded.referrer, referrer),
+        page_url=COALESCE(excluded.page_url, page_url), dnt=COALESCE(excluded.dnt, dnt),
+        net_effective_type=COALESCE(excluded.net_effective_type, net_effective_type),
+        net_downlink=COALESCE(excluded.net_downlink, net_downlink), net_rtt=COALESCE(excluded.net_rtt, net_rtt),
+        net_save_data=COALESCE(excluded.net_save_data, net_save_data), device_memory=COALESCE(excluded.device_memory, device_memory),
+        geo_country=COALESCE(excluded.geo_country, geo_country), geo_region=COALESCE(excluded.geo_region, geo_region),
+        geo_city=COALESCE(excluded.geo_city, geo_city), geo_lat=COALESCE(excluded.geo_lat, geo_lat),
+        geo_lon=COALESCE(excluded.geo_lon, geo_lon), geo_timezone=COALESCE(excluded.geo_timezone, geo_timezone),
+        net_asn=COALESCE(excluded.net_asn, net_asn), net_org=COALESCE(excluded.net_org, net_org),
+        net_isp=COALESCE(excluded.net_isp, net_isp)
+"""
+# Late IP geolocation fills columns the request itself left empty; its country also replaces an edge
+# header's (the first parameter, None when the client sent a precise location). updated_at is left
+# alone, as it tracks visitor activity; geo_updated_at tells the analytics snapshot sync instead.
+_UPDATE_SESSION_GEO_SQL = """
+    UPDATE sessions
+    SET geo_updated_at=?, geo_country=COALESCE(?, geo_country, ?), geo_region=COALESCE(geo_region, ?), geo_city=COALESCE(geo_city, ?),
+        geo_lat=COALESCE(geo_lat, ?), geo_lon=COALESCE(geo_lon, ?), geo_timezone=COALESCE(geo_timezone, ?),
+        net_asn=COALESCE(net_asn, ?), net_org=COALESCE(net_org, ?), net_isp=COALESCE(net_isp, ?)
+    WHERE session_id=?
+"""
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO messages (
+        session_id, role, content, timestamp, message_len, response_len, model_name, server_duration_ms, missing_info, retrieved_sources, context_chars
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_FETCH_HISTORY_SQL = "SELECT role, content, timestamp FROM messages WHERE session_id=? ORDER BY id ASC"
+# Flattened message + session projection used by fetch_analytics. SQLite flattens the view into the
+# outer query, so filters/sorts on timestamp still use idx_messages_ts and sessions are probed by PK.
+# It lives in the analytics snapshot, where its unqualified table names resolve to the mirrored tables.
+_ANALYTICS_VIEW_SQL = (
+    "CREATE VIEW IF NOT EXISTS analytics.v_analytics AS "
+    "SELECT m.timestamp, m.session_id, s.visitor_id, m.role, m.content, "
+    "m.message_len, m.response_len, m.model_name, m.server_duration_ms, "
+    "m.missing_info, m.retrieved_sources, m.context_chars, "
+    "s.user_agent, s.locale, s.timezone, s.referrer, s.page_url, s.dnt, s.ip_plain, s.ip_hash, "
+    "s.geo_country, s.geo_region, s.geo_city, s.geo_lat, s.geo_lon, s.geo_timezone, s.net_asn, s.net_org, s.net_isp, "
+    "s.net_effective_type, s.net_downlink, s.net_rtt, s.net_save_data, s.device_memory "
+    "FROM messages m LEFT JOIN sessions s ON m.session_id = s.session_id"
+)
+_ANALYTICS_SELECT = "SELECT * FROM analytics.v_analytics "
+# Column whitelist for fetch_analytics(fields=...); names are interpolated into SQL, so never bypass it
+_ANALYTICS_FIELDS = frozenset((
+    "timestamp", "session_id", "visitor_id", "role", "content", "message_len", "response_len", "model_name",
+    "server_duration_ms", "missing_info", "retrieved_sources", "context_chars", "user_agent", "locale",
+    "timezone", "referrer", "page_url", "dnt", "ip_plain", "ip_hash", "geo_country", "geo_region", "geo_city",
+    "geo_lat", "geo_lon", "geo_timezone", "net_asn", "net_org", "net_isp", "net_effective_type",
+    "net_downlink", "net_rtt", "net_save_data", "device_memory",
+))
+_SESSIONS_SELECT = (
+    "SELECT session_id, visitor_id, ip_plain, geo_country, geo_region, geo_city, geo_lat, geo_lon, "
+    "created_at, updated_at, duration_seconds "
+    "FROM analytics.sessions "
+)
+
+
+def _sql_variants(select: str, ts_col: str) -> Dict[Tuple[bool, bool], str]:
+    """Prebuild the (has_since, has_limit) variants of a time-windowed query."""
+    out: Dict[Tuple[bool, bool], str] = {}
+    for has_since in (False, True):
+        for has_limit in (False, True):
+            sql = select
+            if has_since:
+                sql += f"WHERE {ts_col} >= ? "
+            sql += f"ORDER BY {ts_col} DESC "
+            if has_limit:
+                sql += "LIMIT ?"
+            out[(has_since, has_limit)] = sql
+    return out
+
+
+_ANALYTICS_SQL = _sql_variants(_ANALYTICS_SELECT, "timestamp")
+# Projections built for fetch_analytics(fields=...), memoized so repeated calls reuse identical SQL text
+_ANALYTICS_SQL_BY_FIELDS: Dict[Tuple[str, ...], Dict[Tuple[bool, bool], str]] = {}
+_SESSIONS_SQL = _sql_variants(_SESSIONS_SELECT, "updated_at")
+
+# Analytics reads run against a snapshot in a separate, ATTACHed database file (analytics.db) that is
+# refreshed incrementally from main. Refreshing only takes write locks on the snapshot file, so
+# analytics traffic never competes with chat writes for the app.db writer lock.
+_ANALYTICS_DB_PATH: Optional[str] = None
+_ANALYTICS_SCHEMA_VERSION = 2
+_SNAPSHOT_MAX_AGE_S = float(os.environ.get("ANALYTICS_SNAPSHOT_MAX_AGE_S", "60"))
+_SNAPSHOT_LOCK = threading.Lock()
+_snapshot_at = 0.0
+_SESSION_COLS = (
+    "session_id", "visitor_id", "created_at", "updated_at", "ip_hash", "ip_plain", "user_agent", "locale",
+    "timezone", "referrer", "page_url", "dnt", "net_effective_type", "net_downlink", "net_rtt", "net_save_data",
+    "device_memory", "geo_country", "geo_region", "geo_city", "geo_lat", "geo_lon", "geo_timezone",
+    "net_asn", "net_org", "net_isp", "geo_updated_at",
+)
+_MESSAGE_COLS = (
+    "id", "session_id", "role", "content", "timestamp", "message_len", "response_len", "model_name",
+    "server_duration_ms", "missing_info", "retrieved_sources", "context_chars",
+)
+# Sessions are mutable, so re-copy everything touched (or geo-filled) in the last minute before the
+# snapshot's newest row (covers writes that committed slightly out of timestamp order). Messages are append-only.
+_SYNC_SESSIONS_SQL = (
+    f"INSERT INTO analytics.sessions ({', '.join(_SESSION_COLS)}) "
+    f"SELECT {', '.join(_SESSION_COLS)} FROM main.sessions "
+    "WHERE updated_at >= (SELECT COALESCE(MAX(updated_at), 0) - 60000 FROM analytics.sessions) "
+    "OR geo_updated_at >= (SELECT COALESCE(MAX(geo_updated_at), 0) - 60000 FROM analytics.sessions) "
+    "ON CONFLICT(session_id) DO UPDATE SET "
+    + ", ".join(f"{c}=excluded.{c}" for c in _SESSION_COLS[1:])
+)
+_SYNC_MESSAGES_SQL = (
+    f"INSERT INTO analytics.messages ({', '.join(_MESSAGE_COLS)}) "
+    f"SELECT {', '.join(_MESSAGE_COLS)} FROM main.messages "
+    "WHERE id > (SELECT COALESCE(MAX(id), 0) FROM analytics.messages)"
+)
+
+
+# Bump whenever the DDL, view or migrations below change so existing databases re-run init
+_SCHEMA_VERSION = 4
+
+_SESSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        session_id TEXT PRIMARY KEY,
+        visitor_id TEXT,
+        -- Timestamps are unix epoch milliseconds (UTC)
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        ip_hash TEXT,
+        ip_plain TEXT,
+        user_agent TEXT,
+        locale TEXT,
+        timezone TEXT,
+        referrer TEXT,
+        page_url TEXT,
+        dnt INTEGER,
+        -- Browser-provided network hints
+        net_effective_type TEXT,
+        net_downlink REAL,
+        net_rtt INTEGER,
+        net_save_data INTEGER,
+        device_memory REAL,
+        -- Geo/IP provider enrichment
+        geo_country TEXT,
+        geo_region TEXT,
+        geo_city TEXT,
+        geo_lat REAL,
+        geo_lon REAL,
+        geo_timezone TEXT,
+        net_asn TEXT,
+        net_org TEXT,
+        net_isp TEXT,
+        -- When the background IP geolocation last filled the row (epoch ms)
+        geo_updated_at INTEGER,
+        -- Derived once per write instead of per analytics read
+        duration_seconds REAL GENERATED ALWAYS AS (ROUND((updated_at - created_at) / 1000.0, 0)) STORED
+    );
+"""
+_MESSAGES_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        -- Unix epoch milliseconds (UTC)
+        timestamp INTEGER NOT NULL,
+        message_len INTEGER,
+        response_len INTEGER,
+        model_name TEXT,
+        server_duration_ms INTEGER,
+        missing_info INTEGER,
+        -- msgpack-encoded list (JSON text in older rows or without msgpack installed)
+        retrieved_sources BLOB,
+        context_chars INTEGER,
+        FOREIGN KEY(session_id) REFERENCES sessions(session_id)
+    );
+"""
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    """Apply the connection PRAGMA block (incl. foreign_keys=ON) in one call; done once per connection."""
+    conn.executescript("".join(_CONN_PRAGMAS))
+
+
+def _has_text_timestamps(conn: sqlite3.Connection, table: str, ts_col: str) -> bool:
+    for row in conn.execute(f"PRAGMA table_xinfo({table});"):
+        if row[1] == ts_col:
+            return (row[2] or "").upper() == "TEXT"
+    return False
+
+
+def _rebuild_with_ms_timestamps(conn: sqlite3.Connection, table: str, ddl: str, ts_cols: Tuple[str, ...]) -> None:
+    """Copy a legacy table with ISO-8601 TEXT timestamps into the INTEGER epoch-ms schema.
+    SQLite cannot change a column's type in place, so this is the create/copy/drop/rename rebuild.
+    """
+    new = f"{table}_new"
+    conn.execute(ddl.format(table=new))
+    # hidden == 0 skips generated columns, which cannot be inserted into
+    cols = [row[1] for row in conn.execute(f"PRAGMA table_xinfo({table});") if row[6] == 0]
+    select = ", ".join(
+        f"CAST(ROUND((julianday({c}) - 2440587.5) * 86400000) AS INTEGER)" if c in ts_cols else c
+        for c in cols
+    )
+    conn.execute(f"INSERT INTO {new} ({', '.join(cols)}) SELECT {select} FROM {table};")
+    conn.execute(f"DROP TABLE {table};")
+    conn.execute(f"ALTER TABLE {new} RENAME TO {table};")
+
 
 def init_db(db_path: Optional[str] = None) -> str:
     """Initialize a SQLite database with sessions and messages tables.
     Returns the absolute DB path in use.
     """
-    global _DB_PATH
+    global _DB_PATH, _ANALYTICS_DB_PATH, _snapshot_at
     if not db_path:
         db_path = os.environ.get("APP_DB_PATH", os.path.join(os.path.dirname(__file__), "data", "app.db"))
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     _DB_PATH = db_path
+    _ANALYTICS_DB_PATH = os.environ.get("ANALYTICS_DB_PATH", os.path.join(os.path.dirname(db_path), "analytics.db"))
 
     with sqlite3.connect(_DB_PATH) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        conn.execute("PRAGMA foreign_keys=ON;")
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                visitor_id TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                ip_hash TEXT,
-                ip_plain TEXT,
-                user_agent TEXT,
-                locale TEXT,
-                timezone TEXT,
-                referrer TEXT,
-                page_url TEXT,
-                dnt INTEGER,
-                -- Browser-provided network hints
-                net_effective_type TEXT,
-                net_downlink REAL,
-                net_rtt INTEGER,
-                net_save_data INTEGER,
-                device_memory REAL,
-                -- Geo/IP provider enrichment
-                geo_country TEXT,
-                geo_region TEXT,
-                geo_city TEXT,
-                geo_lat REAL,
-                geo_lon REAL,
-                geo_timezone TEXT,
-                net_asn TEXT,
-                net_org TEXT,
-                net_isp TEXT
-            );
-            """
-        )
-        # Backward-compatible migrations: add columns if missing
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(sessions);")
-        existing_cols = {row[1] for row in cur.fetchall()}
-        def add_col(name: str, decl: str):
-            if name not in existing_cols:
-                conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {decl};")
-        add_col("ip_plain", "TEXT")
-        add_col("net_effective_type", "TEXT")
-        add_col("net_downlink", "REAL")
-        add_col("net_rtt", "INTEGER")
-        add_col("net_save_data", "INTEGER")
-        add_col("device_memory", "REAL")
-        add_col("geo_country", "TEXT")
-        add_col("geo_region", "TEXT")
-        add_col("geo_city", "TEXT")
-        add_col("geo_lat", "REAL")
-        add_col("geo_lon", "REAL")
-        add_col("geo_timezone", "TEXT")
-        add_col("net_asn", "TEXT")
-        add_col("net_org", "TEXT")
-        add_col("net_isp", "TEXT")
-
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                message_len INTEGER,
-                response_len INTEGER,
-                model_name TEXT,
-                server_duration_ms INTEGER,
-                missing_info INTEGER,
-                retrieved_sources TEXT,
-                context_chars INTEGER,
-                FOREIGN KEY(session_id) REFERENCES sessions(session_id)
-            );
-            """
-        )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_time ON messages(session_id, timestamp);")
+        # page_size and auto_vacuum only take effect on a fresh file, before WAL and any table exist
+        if conn.execute("PRAGMA page_count;").fetchone()[0] == 0:
+            conn.execute("PRAGMA page_size=8192;")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        _apply_pragmas(conn)
+        # Schema setup and migrations are one-shot: steady-state starts only read user_version
+        if conn.execute("PRAGMA user_version;").fetchone()[0] < _SCHEMA_VERSION:
+            # v_analytics now lives in the analytics snapshot. Drop any copy left in main: it would also
+            # block the RENAME step of the table rebuilds below.
+            conn.execute("DROP VIEW IF EXISTS v_analytics;")
+            conn.execute(_SESSIONS_DDL.format(table="sessions"))
+            conn.execute(_MESSAGES_DDL.format(table="messages"))
+
+            # One-time migration of ISO-8601 TEXT timestamps to INTEGER epoch ms
+            legacy_sessions = _has_text_timestamps(conn, "sessions", "created_at")
+            legacy_messages = _has_text_timestamps(conn, "messages", "timestamp")
+            if legacy_sessions or legacy_messages:
+                conn.commit()
+                conn.execute("PRAGMA foreign_keys=OFF;")
+                conn.execute("BEGIN;")
+                if legacy_sessions:
+                    _rebuild_with_ms_timestamps(conn, "sessions", _SESSIONS_DDL, ("created_at", "updated_at"))
+                if legacy_messages:
+                    _rebuild_with_ms_timestamps(conn, "messages", _MESSAGES_DDL, ("timestamp",))
+                conn.commit()
+                conn.execute("PRAGMA foreign_keys=ON;")
+
+            # Backward-compatible migrations: add columns if missing
+            cur = conn.cursor()
+            cur.execute("PRAGMA table_xinfo(sessions);")
+            existing_cols = {row[1] for row in cur.fetchall()}
+            def add_col(name: str, decl: str):
+                if name not in existing_cols:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {decl};")
+            add_col("ip_plain", "TEXT")
+            add_col("net_effective_type", "TEXT")
+            add_col("net_downlink", "REAL")
+            add_col("net_rtt", "INTEGER")
+            add_col("net_save_data", "INTEGER")
+            add_col("device_memory", "REAL")
+            add_col("geo_country", "TEXT")
+            add_col("geo_region", "TEXT")
+            add_col("geo_city", "TEXT")
+            add_col("geo_lat", "REAL")
+            add_col("geo_lon", "REAL")
+            add_col("geo_timezone", "TEXT")
+            add_col("net_asn", "TEXT")
+            add_col("net_org", "TEXT")
+            add_col("net_isp", "TEXT")
+            add_col("geo_updated_at", "INTEGER")
+
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_time ON messages(session_id, timestamp);")
+            # Global time-range indexes serving fetch_analytics / fetch_analytics_sessions ORDER BY ... DESC LIMIT
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(timestamp DESC);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at DESC);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_geo_updated ON sessions(geo_updated_at) WHERE geo_updated_at IS NOT NULL;")
+            conn.execute("ANALYZE;")
+            conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION};")
+
+        conn.execute("ATTACH DATABASE ? AS analytics;", (_ANALYTICS_DB_PATH,))
+        conn.execute("PRAGMA analytics.journal_mode=WAL;")
+        if conn.execute("PRAGMA analytics.user_version;").fetchone()[0] < _ANALYTICS_SCHEMA_VERSION:
+            conn.execute(_SESSIONS_DDL.format(table="analytics.sessions"))
+            conn.execute(_MESSAGES_DDL.format(table="analytics.messages"))
+            if not any(row[1] == "geo_updated_at" for row in conn.execute("PRAGMA analytics.table_xinfo(sessions);")):
+                conn.execute("ALTER TABLE analytics.sessions ADD COLUMN geo_updated_at INTEGER;")
+            conn.execute("CREATE INDEX IF NOT EXISTS analytics.idx_messages_ts ON messages(timestamp DESC);")
+            conn.execute("CREATE INDEX IF NOT EXISTS analytics.idx_sessions_updated ON sessions(updated_at DESC);")
+            conn.execute("CREATE INDEX IF NOT EXISTS analytics.idx_sessions_geo_updated ON sessions(geo_updated_at);")
+            conn.execute(_ANALYTICS_VIEW_SQL)
+            conn.execute(f"PRAGMA analytics.user_version={_ANALYTICS_SCHEMA_VERSION};")
+        conn.commit()
+        conn.execute("DETACH DATABASE analytics;")
+    _snapshot_at = 0.0
+    _start_optimizer()
     return _DB_PATH
 
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
 
 
-def _conn() -> sqlite3.Connection:
+def _ms_to_iso(ms: Optional[int]) -> Optional[str]:
+    """Convert a stored epoch-ms timestamp back to ISO-8601 (UTC) at the API boundary."""
+    if ms is None:
+        return None
+    secs, millis = divmod(int(ms), 1000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs)) + f".{millis:03d}000+00:00"
+
+
+def _open_conn(attach_analytics: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(_DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+    if attach_analytics:
+        conn.execute("ATTACH DATABASE ? AS analytics;", (_ANALYTICS_DB_PATH,))
+    _apply_pragmas(conn)
+    return conn
+
+
+def _thread_conn(attr: str, attach_analytics: bool) -> sqlite3.Connection:
     if not _DB_PATH:
         init_db()
-    conn = sqlite3.connect(_DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys=ON;")
+    conn = getattr(_LOCAL, attr, None)
+    if conn is not None and getattr(_LOCAL, attr + "_path", None) == _DB_PATH:
+        return conn
+    conn = _open_conn(attach_analytics)
+    setattr(_LOCAL, attr, conn)
+    setattr(_LOCAL, attr + "_path", _DB_PATH)
+    with _OPEN_CONNS_LOCK:
+        _OPEN_CONNS.append(conn)
     return conn
 
 
+def _conn() -> sqlite3.Connection:
+    """Return this thread's persistent connection to main, opening it on first use.
+    Connections run in autocommit mode; writers wrap their statements in _write_tx().
+    """
+    return _thread_conn("conn", attach_analytics=False)
+
+
+def _analytics_conn() -> sqlite3.Connection:
+    """Return this thread's persistent read/refresh connection with the analytics snapshot ATTACHed.
+    Writers never use it: BEGIN IMMEDIATE locks every attached database, so chat writes on an attached
+    connection would also lock analytics.db and contend with snapshot refreshes.
+    """
+    return _thread_conn("analytics_conn", attach_analytics=True)
+
+
+@contextmanager
+def _write_tx():
+    """Run the enclosed statements in a single BEGIN IMMEDIATE ... COMMIT transaction."""
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield conn
+        # Inside the try: a failed COMMIT (e.g. SQLITE_BUSY) must roll back, or this thread's
+        # persistent connection would be left inside an open transaction
+        conn.execute("COMMIT;")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK;")
+        raise
+
+
+@atexit.register
+def _close_conns() -> None:
+    with _OPEN_CONNS_LOCK:
+        conns = list(_OPEN_CONNS)
+        _OPEN_CONNS.clear()
+    for conn in conns:
+        try:
+            _optimize(conn)
+            conn.close()
+        except Exception:
+            pass
+
+
+def _optimize(conn: sqlite3.Connection) -> None:
+    # analysis_limit bounds how many rows ANALYZE samples per index, keeping this cheap on large tables
+    conn.execute("PRAGMA analysis_limit=400;")
+    conn.execute("PRAGMA optimize;")
+
+
+def _optimize_loop() -> None:
+    while True:
+        time.sleep(_OPTIMIZE_INTERVAL_S)
+        try:
+            _optimize(_conn())
+        except Exception:
+            pass
+
+
+def _start_optimizer() -> None:
+    global _OPTIMIZER
+    with _OPEN_CONNS_LOCK:
+        if _OPTIMIZER is None:
+            _OPTIMIZER = threading.Thread(target=_optimize_loop, name="db-optimize", daemon=True)
+            _OPTIMIZER.start()
+
+
+@functools.lru_cache(maxsize=8192)
+def _salted_sha256(value: str, salt: str) -> str:
+    return hashlib.sha256((value + salt).encode("utf-8")).hexdigest()
+
+
 def sha256_hex(value: str) -> str:
-    salt = os.environ.get("ANALYTICS_SALT", "")
-    hasher = hashlib.sha256()
-    hasher.update((value + salt).encode("utf-8"))
-    return hasher.hexdigest()
+    # The salt is looked up per call (server loads .env after importing this module)
+    # and is part of the memo key, so repeat visitors skip the hash entirely.
+    return _salted_sha256(value, os.environ.get("ANALYTICS_SALT", ""))
 
 
-def upsert_session(
+def _session_row(
     session_id: str,
     visitor_id: Optional[str] = None,
     ip: Optional[str] = None,
@@ -148,100 +508,110 @@ def upsert_session(
     net_asn: Optional[str] = None,
     net_org: Optional[str] = None,
     net_isp: Optional[str] = None,
-) -> None:
-    now = _now_iso()
+) -> Tuple[Any, ...]:
+    now = _now_ms()
     ip_hash = sha256_hex(ip) if ip else None
-    with _conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT session_id FROM sessions WHERE session_id=?", (session_id,))
-        if cur.fetchone() is None:
-            cur.execute(
-                """
-                INSERT INTO sessions (
-                    session_id, visitor_id, created_at, updated_at, ip_hash, ip_plain, user_agent, locale, timezone, referrer, page_url, dnt,
-                    net_effective_type, net_downlink, net_rtt, net_save_data, device_memory,
-                    geo_country, geo_region, geo_city, geo_lat, geo_lon, geo_timezone, net_asn, net_org, net_isp
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    session_id,
-                    visitor_id,
-                    now,
-                    now,
-                    ip_hash,
-                    ip_plain or ip,
-                    user_agent,
-                    locale,
-                    timezone_s,
-                    referrer,
-                    page_url,
-                    1 if dnt else 0 if dnt is not None else None,
-                    net_effective_type,
-                    net_downlink,
-                    net_rtt,
-                    1 if net_save_data else 0 if net_save_data is not None else None,
-                    device_memory,
-                    geo_country,
-                    geo_region,
-                    geo_city,
-                    geo_lat,
-                    geo_lon,
-                    geo_timezone,
-                    net_asn,
-                    net_org,
-                    net_isp,
-                ),
-            )
-        else:
-            cur.execute(
-                """
-                UPDATE sessions
-                SET updated_at=?, visitor_id=COALESCE(?, visitor_id), ip_hash=COALESCE(?, ip_hash), ip_plain=COALESCE(?, ip_plain),
-                    user_agent=COALESCE(?, user_agent), locale=COALESCE(?, locale), timezone=COALESCE(?, timezone),
-                    referrer=COALESCE(?, referrer), page_url=COALESCE(?, page_url), dnt=COALESCE(?, dnt),
-                    net_effective_type=COALESCE(?, net_effective_type), net_downlink=COALESCE(?, net_downlink), net_rtt=COALESCE(?, net_rtt),
-                    net_save_data=COALESCE(?, net_save_data), device_memory=COALESCE(?, device_memory),
-                    geo_country=COALESCE(?, geo_country), geo_region=COALESCE(?, geo_region), geo_city=COALESCE(?, geo_city),
-                    geo_lat=COALESCE(?, geo_lat), geo_lon=COALESCE(?, geo_lon), geo_timezone=COALESCE(?, geo_timezone),
-                    net_asn=COALESCE(?, net_asn), net_org=COALESCE(?, net_org), net_isp=COALESCE(?, net_isp)
-                WHERE session_id=?
-                """,
-                (
-                    now,
-                    visitor_id,
-                    ip_hash,
-                    ip_plain or ip,
-                    user_agent,
-                    locale,
-                    timezone_s,
-                    referrer,
-                    page_url,
-                    1 if dnt else 0 if dnt is not None else None,
-                    net_effective_type,
-                    net_downlink,
-                    net_rtt,
-                    1 if net_save_data else 0 if net_save_data is not None else None,
-                    device_memory,
-                    geo_country,
-                    geo_region,
-                    geo_city,
-                    geo_lat,
-                    geo_lon,
-                    geo_timezone,
-                    net_asn,
-                    net_org,
-                    net_isp,
-                    session_id,
-                ),
-            )
-        conn.commit()
+    return (
+        session_id,
+        visitor_id,
+        now,
+        now,
+        ip_hash,
+        ip_plain or ip,
+        user_agent,
+        locale,
+        timezone_s,
+        referrer,
+        page_url,
+        1 if dnt else 0 if dnt is not None else None,
+        net_effective_type,
+        net_downlink,
+        net_rtt,
+        1 if net_save_data else 0 if net_save_data is not None else None,
+        device_memory,
+        geo_country,
+        geo_region,
+        geo_city,
+        geo_lat,
+        geo_lon,
+        geo_timezone,
+        net_asn,
+        net_org,
+        net_isp,
+    )
+
+
+def upsert_session(session_id: str, **fields: Any) -> None:
+    """Upsert a session synchronously; fields are the _session_row() keyword arguments."""
+    row = _session_row(session_id, **fields)
+    with _write_tx() as conn:
+        conn.execute(_UPSERT_SESSION_SQL, row)
+
+
+def queue_session(session_id: str, **fields: Any) -> Future:
+    """Buffer a session upsert for the batched writer. Rows are written in submission order,
+    so messages queued after it never trip the sessions foreign key.
+    """
+    return _WRITE_BUFFER.submit(_UPSERT_SESSION_SQL, _session_row(session_id, **fields))
+
+
+def queue_session_geo(session_id: str, geo: Dict[str, Any], country_wins: bool = True) -> Future:
+    """Buffer filling a session's missing geo/network columns from a server-side IP lookup.
+    With country_wins the looked-up country also replaces one taken from edge headers; pass False
+    when the stored country came from the client's precise location.
+    """
+    row = (
+        _now_ms(),
+        geo.get("country") if country_wins else None,
+        geo.get("country"),
+        geo.get("region"),
+        geo.get("city"),
+        geo.get("lat"),
+        geo.get("lon"),
+        geo.get("timezone"),
+        geo.get("asn"),
+        geo.get("org"),
+        geo.get("isp"),
+        session_id,
+    )
+    return _WRITE_BUFFER.submit(_UPDATE_SESSION_GEO_SQL, row)
+
+
+def _message_row(
+    session_id: str,
+    role: str,
+    content: str,
+    timestamp: Optional[int],
+    message_len: Optional[int],
+    response_len: Optional[int],
+    model_name: Optional[str],
+    server_duration_ms: Optional[int],
+    missing_info: Optional[bool],
+    retrieved_sources: Optional[List[str]],
+    context_chars: Optional[int],
+) -> Tuple[Any, ...]:
+    ts = timestamp or _now_ms()
+    sources_blob = _pack_sources(retrieved_sources) if isinstance(retrieved_sources, list) else None
+    return (
+        session_id,
+        role,
+        content,
+        ts,
+        message_len,
+        response_len,
+        model_name,
+        server_duration_ms,
+        1 if missing_info else 0 if missing_info is not None else None,
+        sources_blob,
+        context_chars,
+    )
 
 
 def insert_message(
     session_id: str,
     role: str,
     content: str,
-    timestamp: Optional[str] = None,
+    timestamp: Optional[int] = None,
     message_len: Optional[int] = None,
     response_len: Optional[int] = None,
     model_name: Optional[str] = None,
@@ -250,114 +620,265 @@ def insert_message(
     retrieved_sources: Optional[List[str]] = None,
     context_chars: Optional[int] = None,
 ) -> int:
-    ts = timestamp or _now_iso()
-    sources_json = json.dumps(retrieved_sources) if isinstance(retrieved_sources, list) else None
-    with _conn() as conn:
+    """Insert one message synchronously and return its row id."""
+    row = _message_row(
+        session_id, role, content, timestamp, message_len, response_len,
+        model_name, server_duration_ms, missing_info, retrieved_sources, context_chars,
+    )
+    with _write_tx() as conn:
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO messages (
-                session_id, role, content, timestamp, message_len, response_len, model_name, server_duration_ms, missing_info, retrieved_sources, context_chars
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                session_id,
-                role,
-                content,
-                ts,
-                message_len,
-                response_len,
-                model_name,
-                server_duration_ms,
-                1 if missing_info else 0 if missing_info is not None else None,
-                sources_json,
-                context_chars,
-            ),
-        )
-        conn.commit()
+        cur.execute(_INSERT_MESSAGE_SQL, row)
         return int(cur.lastrowid)
 
 
+class _WriteBuffer:
+    """Single writer for the request path: coalesces queued statements into batched transactions on a
+    background thread, so handlers never block on SQLite. A batch is flushed once it holds max_batch
+    rows or max_wait_s has passed since its first row. Rows are applied in submission order.
+    """
+
+    def __init__(self, max_batch: int = 200, max_wait_s: float = 0.05):
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self._queue: "queue.Queue[Tuple[str, Tuple[Any, ...], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, sql: str, row: Tuple[Any, ...]) -> Future:
+        fut: Future = Future()
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put((sql, row, fut))
+        return fut
+
+    def flush(self) -> None:
+        """Block until every queued row has been written (or failed)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, batch: List[Tuple[str, Tuple[Any, ...], Future]]) -> List[Optional[int]]:
+        """Apply each run of same-statement rows with one executemany; message inserts resolve to their row ids."""
+        results: List[Optional[int]] = []
+        for sql, run in itertools.groupby(batch, key=lambda item: item[0]):
+            rows = [row for _, row, _ in run]
+            conn.executemany(sql, rows)
+            if sql == _INSERT_MESSAGE_SQL:
+                # AUTOINCREMENT ids are contiguous inside one IMMEDIATE transaction
+                last_id = conn.execute("SELECT last_insert_rowid();").fetchone()[0]
+                results.extend(range(last_id - len(rows) + 1, last_id + 1))
+            else:
+                results.extend([None] * len(rows))
+        return results
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results: List[Any]
+                try:
+                    with _write_tx() as conn:
+                        results = self._write(conn, batch)
+                except Exception:
+                    # Retry row by row so one bad row (e.g. a missing session) doesn't drop the batch
+                    results = []
+                    for item in batch:
+                        try:
+                            with _write_tx() as conn:
+                                results.append(self._write(conn, [item])[0])
+                        except Exception as e:
+                            results.append(e)
+                # Resolved only once the rows are committed, so nothing raised here can trigger a rewrite
+                for (_, _, fut), result in zip(batch, results):
+                    if fut.done():
+                        continue
+                    if isinstance(result, Exception):
+                        fut.set_exception(result)
+                    else:
+                        fut.set_result(result)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_WRITE_BUFFER = _WriteBuffer()
+
+def queue_message(
+    session_id: str,
+    role: str,
+    content: str,
+    timestamp: Optional[int] = None,
+    message_len: Optional[int] = None,
+    response_len: Optional[int] = None,
+    model_name: Optional[str] = None,
+    server_duration_ms: Optional[int] = None,
+    missing_info: Optional[bool] = None,
+    retrieved_sources: Optional[List[str]] = None,
+    context_chars: Optional[int] = None,
+) -> Future:
+    """Buffer a message for the batched writer. Returns a Future resolving to its row id.
+    Use insert_message() when the id is needed synchronously.
+    """
+    row = _message_row(
+        session_id, role, content, timestamp, message_len, response_len,
+        model_name, server_duration_ms, missing_info, retrieved_sources, context_chars,
+    )
+    return _WRITE_BUFFER.submit(_INSERT_MESSAGE_SQL, row)
+
+
+def flush_messages() -> None:
+    """Wait for all buffered messages to be committed."""
+    _WRITE_BUFFER.flush()
+
+
+# Registered after _close_conns so it runs first at exit (atexit is LIFO)
+atexit.register(flush_messages)
+
+
+def refresh_analytics_snapshot(force: bool = False) -> None:
+    """Copy new/updated sessions and new messages from main into the analytics snapshot.
+    Skipped when the snapshot is younger than ANALYTICS_SNAPSHOT_MAX_AGE_S unless force=True.
+    """
+    global _snapshot_at
+    with _SNAPSHOT_LOCK:
+        if not force and _snapshot_at and time.monotonic() - _snapshot_at < _SNAPSHOT_MAX_AGE_S:
+            return
+        flush_messages()
+        conn = _analytics_conn()
+        # Deferred BEGIN: main is only read, so the write lock is taken on analytics.db alone
+        conn.execute("BEGIN;")
+        try:
+            conn.execute(_SYNC_SESSIONS_SQL)
+            conn.execute(_SYNC_MESSAGES_SQL)
+            conn.execute("COMMIT;")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            raise
+        _snapshot_at = time.monotonic()
+
+
 def fetch_history(session_id: str) -> List[Dict[str, Any]]:
-    with _conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT role, content, timestamp FROM messages WHERE session_id=? ORDER BY id ASC",
-            (session_id,),
-        )
-        rows = cur.fetchall()
-        return [{"role": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
+    flush_messages()
+    cur = _conn().cursor()
+    cur.execute(_FETCH_HISTORY_SQL, (session_id,))
+    rows = cur.fetchall()
+    return [{"role": r[0], "content": r[1], "timestamp": _ms_to_iso(r[2])} for r in rows]
+
+
+def _analytics_sql(fields: Optional[Tuple[str, ...]]) -> Dict[Tuple[bool, bool], str]:
+    if not fields:
+        return _ANALYTICS_SQL
+    key = tuple(fields)
+    variants = _ANALYTICS_SQL_BY_FIELDS.get(key)
+    if variants is None:
+        unknown = set(key) - _ANALYTICS_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown analytics fields: {sorted(unknown)}")
+        variants = _sql_variants(f"SELECT {', '.join(key)} FROM analytics.v_analytics ", "timestamp")
+        _ANALYTICS_SQL_BY_FIELDS[key] = variants
+    return variants
 
 
-def fetch_analytics(days: Optional[int] = 30, limit: Optional[int] = 5000) -> List[Dict[str, Any]]:
-    """Return flattened analytics rows joining messages with session metadata.
+def fetch_analytics(
+    days: Optional[int] = 30,
+    limit: Optional[int] = 5000,
+    fields: Optional[Tuple[str, ...]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Return flattened analytics rows joining messages with session metadata, streamed from the cursor.
     days: number of days back from now to include (None for all)
     limit: max number of rows (None for all)
+    fields: subset of columns to select (None for all); unknown names raise ValueError
+    Like fetch_analytics_sessions, the query runs before this returns and rows stream from a dedicated
+    connection, so errors reach the caller and the iterator can be consumed from any thread.
     """
-    since_iso = None
+    sql_variants = _analytics_sql(fields)
+    since_ms = None
     if days is not None:
-        since_dt = datetime.now(timezone.utc) - timedelta(days=days)
-        since_iso = since_dt.isoformat()
+        since_ms = _now_ms() - days * 86_400_000
 
-    with _conn() as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        sql = (
-            "SELECT m.timestamp, m.session_id, s.visitor_id, m.role, m.content, "
-            "m.message_len, m.response_len, m.model_name, m.server_duration_ms, "
-            "m.missing_info, m.retrieved_sources, m.context_chars, "
-            "s.user_agent, s.locale, s.timezone, s.referrer, s.page_url, s.dnt, s.ip_plain, s.ip_hash, "
-            "s.geo_country, s.geo_region, s.geo_city, s.geo_lat, s.geo_lon, s.geo_timezone, s.net_asn, s.net_org, s.net_isp, "
-            "s.net_effective_type, s.net_downlink, s.net_rtt, s.net_save_data, s.device_memory "
-            "FROM messages m LEFT JOIN sessions s ON m.session_id = s.session_id "
-        )
-        params: List[Any] = []
-        if since_iso:
-            sql += "WHERE m.timestamp >= ? "
-            params.append(since_iso)
-        sql += "ORDER BY m.timestamp DESC "
-        if limit is not None:
-            sql += "LIMIT ?"
-            params.append(limit)
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        out: List[Dict[str, Any]] = []
-        for r in rows:
-            d = dict(r)
+    refresh_analytics_snapshot()
+    conn = _open_conn(attach_analytics=True)
+    params: List[Any] = []
+    if since_ms is not None:
+        params.append(since_ms)
+    if limit is not None:
+        params.append(limit)
+    sql = sql_variants[(since_ms is not None, limit is not None)]
+    try:
+        cur = conn.execute(sql, params)
+    except BaseException:
+        conn.close()
+        raise
+    return _iter_analytics_rows(conn, cur)
+
+
+def _iter_analytics_rows(conn: sqlite3.Connection, cur: sqlite3.Cursor) -> Iterator[Dict[str, Any]]:
+    try:
+        cols = [c[0] for c in cur.description]
+        has_ts = "timestamp" in cols
+        src_idx = cols.index("retrieved_sources") if "retrieved_sources" in cols else None
+        for r in cur:
+            d = dict(zip(cols, r))
+            if has_ts:
+                d["timestamp"] = _ms_to_iso(d["timestamp"])
             # Normalize retrieved_sources to list
-            try:
-                if d.get("retrieved_sources"):
-                    d["retrieved_sources"] = json.loads(d["retrieved_sources"]) if isinstance(d["retrieved_sources"], str) else d["retrieved_sources"]
-            except Exception:
-                pass
-            out.append(d)
-        return out
+            raw = r[src_idx] if src_idx is not None else None
+            if raw:
+                try:
+                    d["retrieved_sources"] = _unpack_sources(raw)
+                except Exception:
+                    pass
+            yield d
+    finally:
+        conn.close()
 
 
-def fetch_analytics_sessions(days: Optional[int] = 30, limit: Optional[int] = 1000) -> List[Dict[str, Any]]:
-    """Return per-session analytics: visitor_id, ip, location, duration.
+def fetch_analytics_sessions(days: Optional[int] = 30, limit: Optional[int] = 1000) -> Iterator[Dict[str, Any]]:
+    """Return per-session analytics rows (visitor_id, ip, location, duration), streamed from the cursor.
     duration_seconds = updated_at - created_at
+    The query runs before this returns, so errors surface to the caller rather than mid-iteration.
+    Rows stream from a connection of their own, closed once they are exhausted, so the iterator can be
+    consumed from any thread without touching the thread-local connections.
     """
-    since_iso = None
+    since_ms = None
     if days is not None:
-        since_dt = datetime.now(timezone.utc) - timedelta(days=days)
-        since_iso = since_dt.isoformat()
-    with _conn() as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        sql = (
-            "SELECT session_id, visitor_id, ip_plain, geo_country, geo_region, geo_city, geo_lat, geo_lon, "
-            "created_at, updated_at, ROUND((julianday(updated_at) - julianday(created_at)) * 86400, 0) AS duration_seconds "
-            "FROM sessions "
-        )
-        params: List[Any] = []
-        if since_iso:
-            sql += "WHERE updated_at >= ? "
-            params.append(since_iso)
-        sql += "ORDER BY updated_at DESC "
-        if limit is not None:
-            sql += "LIMIT ?"
-            params.append(limit)
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        return [dict(r) for r in rows]
+        since_ms = _now_ms() - days * 86_400_000
+    refresh_analytics_snapshot()
+    conn = _open_conn(attach_analytics=True)
+    params: List[Any] = []
+    if since_ms is not None:
+        params.append(since_ms)
+    if limit is not None:
+        params.append(limit)
+    sql = _SESSIONS_SQL[(since_ms is not None, limit is not None)]
+    try:
+        cur = conn.execute(sql, params)
+    except BaseException:
+        conn.close()
+        raise
+    return _iter_session_rows(conn, cur)
+
+
+def _iter_session_rows(conn: sqlite3.Connection, cur: sqlite3.Cursor) -> Iterator[Dict[str, Any]]:
+    try:
+        cols = [c[0] for c in cur.description]
+        for r in cur:
+            d = dict(zip(cols, r))
+            d["created_at"] = _ms_to_iso(d["created_at"])
+            d["updated_at"] = _ms_to_iso(d["updated_at"])
+            yield d
+    finally:
+        conn.close()
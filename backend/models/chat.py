@@ -1,8 +1,15 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 
 class ClientMeta(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     visitor_id: Optional[str] = Field(None, description="Anonymous visitor id")
     user_agent: Optional[str] = None
     locale: Optional[str] = None
@@ -25,20 +32,28 @@ class ClientMeta(BaseModel):
     geo_city: Optional[str] = None
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     message: str = Field(..., description="User message")
     session_id: str = Field(..., description="Session ID for conversation tracking")
     meta: Optional[ClientMeta] = Field(None, description="Optional client metadata for analytics")
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     response: str = Field(..., description="AI assistant response")
     session_id: str = Field(..., description="Session ID")
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     role: str = Field(..., description="Role: user or assistant")
     content: str = Field(..., description="Message content")
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 class ChatHistoryResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     session_id: str
     messages: List[ChatMessage]
\ No newline at end of file
@@ -1,21 +1,328 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, Callable, List
 from pathlib import Path
 from langchain_community.vectorstores import FAISS
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.util import cos_sim
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import json
 import re
+import hashlib
+import tempfile
+import time
+import asyncio
+import threading
+import queue
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from itertools import islice
 from langchain.schema import HumanMessage, AIMessage
 from typing_extensions import TypedDict
 from db import fetch_history
+from rag.session_store import make_session_store
 
+try:
+    import orjson
+except ImportError:  # optional; fall back to stdlib json
+    orjson = None
 
-class AgentState(TypedDict):
+try:
+    import simsimd
+except ImportError:  # optional; NumPy fallback in _cosine_distances
+    simsimd = None
+
+# Storage precision for the in-memory chunk matrix: "int8" (default, 4x less memory traffic),
+# "float16" (2x less, scored by SimSIMD's f16 kernels) or "float32"
+CHUNK_DTYPE = os.getenv("RAG_CHUNK_DTYPE", "int8").strip().lower()
+# Cosine similarity above which a recent answer to a near-identical (question, context) is reused
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RAG_RESPONSE_CACHE_THRESHOLD", "0.94"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "1000"))
+# Where the derived chunk matrix is saved so every worker process mmaps one copy; /dev/shm (tmpfs)
+# is POSIX shared memory, so workers map the same physical pages without touching disk
+CHUNK_CACHE_DIR = os.getenv("RAG_CHUNK_CACHE_DIR") or ("/dev/shm" if os.access("/dev/shm", os.W_OK) else tempfile.gettempdir())
+# Corpus size from which retrieval uses the FAISS (HNSW) index instead of the brute-force matrix scan
+ANN_MIN_CHUNKS = int(os.getenv("RAG_ANN_MIN_CHUNKS", "5000"))
+# Seconds to wait on a model before also firing the next fallback candidate
+HEDGE_DELAY_S = float(os.getenv("RAG_HEDGE_DELAY_S", "3.0"))
+# Workers for the (hedged) OpenRouter calls. By default every server thread can have each candidate
+# model in flight at once (configured model + OPENROUTER_FALLBACK_MODELS + the built-in default);
+# the pool only starts threads as they are needed
+HEDGE_WORKERS = int(os.getenv("RAG_HEDGE_WORKERS", "0")) or int(os.getenv("SERVER_THREADS", "64")) * (
+    2 + len([m for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]))
+# Shared by every agent so a reindex does not leak workers
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="openrouter")
+# Micro-batching window for concurrent query encodes
+QUERY_BATCH_MAX = int(os.getenv("RAG_QUERY_BATCH_MAX", "16"))
+QUERY_BATCH_WAIT_S = float(os.getenv("RAG_QUERY_BATCH_WAIT_MS", "10")) / 1000.0
+# Messages kept in memory per session
+SESSION_MEMORY_MAXLEN = 20
+
+# Special tokens BOS/EOS and model boundary markers, fused into one pass for _clean_text
+_CLEAN_RE = re.compile(
+    r"<\|(?:begin|end)[_\s]*of[_\s]*(?:sentence|text)\|>"
+    r"|</?s>"
+    r"|<｜(?:begin|end)▁of▁sentence｜>",
+    re.IGNORECASE,
+)
+
+def _json_dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+def _json_loads(raw: str | bytes) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the stdlib type
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+_ANSWER_KEY_RE = re.compile(r'"answer"\s*:\s*"')
+_MISSING_INFO_RE = re.compile(r'"missing_info"\s*:\s*(true|false)')
+
+
+def _answer_span(content: str) -> tuple[int, int, bool] | None:
+    """(start, end, closed) of the raw "answer" string value within partial JSON content."""
+    m = _ANSWER_KEY_RE.search(content)
+    if not m:
+        return None
+    i = j = m.end()
+    while j < len(content):
+        c = content[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == '"':
+            return i, j, True
+        j += 1
+    return i, len(content), False
+
+
+# Entertainment mentions (substring, case-insensitive), scanned in one pass
+_ENT_RE = re.compile("|".join(map(re.escape, [
+    "anime",
+    "one piece", "naruto", "bleach", "jujutsu kaisen", "tokyo revengers",
+    "fullmetal alchemist", "demon slayer", "black clover",
+    "breaking bad", "dark", "prison break", "money heist"
+])), re.IGNORECASE)
+
+
+def _early_answer(content: str) -> dict | None:
+    """Extract the answer from a partial JSON object once its string value is closed."""
+    span = _answer_span(content)
+    if span is None or not span[2]:
+        return None
+    i, j, _ = span
+    try:
+        obj: Dict[str, Any] = {"answer": _json_loads(f'"{content[i:j]}"')}
+    except ValueError:
+        return None
+    mi = _MISSING_INFO_RE.search(content, 0, i)
+    if mi:
+        obj["missing_info"] = mi.group(1) == "true"
+    return obj
+
+
+def _partial_answer(content: str) -> str:
+    """Decoded answer text received so far (may be empty), dropping any escape cut off mid-stream."""
+    span = _answer_span(content)
+    if span is None:
+        return ""
+    i, j, closed = span
+    raw = content[i:j]
+    if not closed:
+        k = raw.rfind("\\", max(0, len(raw) - 6))
+        if k != -1:
+            # Only an escape start if preceded by an even run of backslashes
+            run = len(raw[:k]) - len(raw[:k].rstrip("\\"))
+            if run % 2 == 0 and (k == len(raw) - 1 or (raw[k + 1] == "u" and len(raw) - k < 6)):
+                raw = raw[:k]
+    try:
+        # stdlib json tolerates a lone surrogate from a split pair; it is trimmed below
+        text = json.loads(f'"{raw}"')
+    except ValueError:
+        return ""
+    if text and "\ud800" <= text[-1] <= "\udbff":
+        text = text[:-1]
+    return text
+
+# Whole-message greetings and acknowledgements; retrieval is skipped for these
+_SMALL_TALK_RE = re.compile(
+    r"(?i)^\W*(?:hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|nice|great|awesome|bye|goodbye"
+    r"|good (?:morning|afternoon|evening|night))(?: there| so much| a lot)?[\s!.,?]*$"
+)
+
+# _apply_invariants: question triggers and output rewrites
+_ASKS_CURRENT_RE = re.compile("|".join(map(re.escape, [
+    "what are you doing these days",
+    "what are you working on",
+    "currently working",
+    "these days",
+    "what are you up to",
+])), re.IGNORECASE)
+_MENTIONS_SIDE_RE = re.compile("|".join(map(re.escape, [
+    "side project", "side projects", "secondary project", "hustle", "hustles", "side-project", "secondary projects"
+])), re.IGNORECASE)
+_RATL_NORM_RE = re.compile(r"\bratl\s*\.?\s*ai\b", re.IGNORECASE)
+_PORTFOLIO_SENTENCE_RE = re.compile(r"(?i)([^.?!]*\bportfolio manager\b[^.?!]*[.?!])")
+_MULTI_SPACE_RE = re.compile(r"\s{2,}")
+_PORTFOLIO_AT_RATL_RE = re.compile(r"\b(ai\s+)?portfolio\s+manager\s+at\s*ratl\.ai\b", re.IGNORECASE)
+_THE_RATL_RE = re.compile(r"\bthe\s+ratl\.ai\b", re.IGNORECASE)
+
+
+# Transcript labels by exact message type; subclasses and role-tagged dict-likes take the slow path
+_ROLE_MAP = {HumanMessage: "User", AIMessage: "Assistant"}
+_ROLE_ATTR = {"user": "User", "assistant": "Assistant"}
+
+
+def _role_of(m: Any) -> str | None:
+    role = _ROLE_MAP.get(type(m))
+    if role is None:
+        if isinstance(m, HumanMessage):
+            role = "User"
+        elif isinstance(m, AIMessage):
+            role = "Assistant"
+        else:
+            role = _ROLE_ATTR.get(getattr(m, 'role', None))
+    return role
+
+
+def _transcript(messages: Any, n: int = 4) -> str:
+    """'Role: content' lines for the last n messages, read from the end without copying the history."""
+    recent = list(islice(reversed(messages), n))[::-1]
+    return "\n".join(f"{role}: {m.content}" for m in recent if (role := _role_of(m)))
+
+
+def _is_user(m: Any) -> bool:
+    return _role_of(m) == "User"
+
+
+def _last_user(messages: Any) -> Any:
+    """Most recent user message; the turn's own message is normally last, so check that first."""
+    if messages and _is_user(messages[-1]):
+        return messages[-1]
+    return next((m for m in reversed(messages) if _is_user(m)), None)
+
+
+def _quantize_i8(mat: np.ndarray) -> tuple[np.ndarray, float]:
+    """L2-normalize rows and quantize symmetrically to int8; returns (int8 matrix, scale).
+    Cosine scoring is scale-invariant, so callers may drop the scale."""
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    mat = mat / np.maximum(norms, 1e-12)
+    max_abs = float(np.abs(mat).max()) or 1.0
+    scale = 127.0 / max_abs
+    return np.clip(np.round(mat * scale), -127, 127).astype(np.int8), scale
+
+
+# Persona instructions and per-turn prompt; filled with str.format (the text has no other braces)
+_SYSTEM_PROMPT_TPL = (
+    "You are Tejas M. Reply as a friendly human in first person. "
+    "Keep answers short (2–3 sentences) unless the user explicitly asks for more. "
+    "Be confident and conversational; vary phrasing so it never feels templated. "
+    "Ground your answer in the provided Context when relevant; if the answer is not in the Context, acknowledge it briefly in a natural way (e.g., \"I'm not sure\", \"I don't have an idea about that yet\", or \"I don't have that info handy right now\"). Vary the wording across turns. "
+    "When mentioning academic scores/percentages/CGPA, avoid bare numbers—prefer phrasing like \"I scored 88.5% in PU\" or \"I finished with an 8.3 CGPA.\" "
+    "Canonical profile: You are a full‑stack engineer (frontend and backend). When discussing your work at Fynd, explicitly describe full‑stack responsibilities; never imply you handled only frontend. "
+    "For questions about what you're working on now, treat your current focus (ratl.ai) as canonical—even if it isn't present in the retrieved Context—answer with that first. Mention the AI portfolio manager only if explicitly asked or if the user asks for side projects, keep it brief, and point people to https://ratl.ai for details. "
+    "Playful entertainment note: you enjoy anime and good TV dramas; mention this casually and only when relevant. "
+    "Do not repeat it across messages. "
+    "If entertainment_mentioned_in_session is true, avoid bringing it up again unless the user asks directly. "
+    "entertainment_mentioned_in_session={ent_flag}. "
+    "You MUST output a single JSON object that conforms to the provided JSON Schema. Do not include any text before or after the JSON."
+)
+_USER_PROMPT_TPL = (
+    "Follow the instructions and return a JSON object only.\n"
+    "entertainment_mentioned_in_session: {ent_flag}\n\n"
+    "Conversation (recent):\n{convo}\n\n"
+    "Context:\n{context}\n\n"
+    "Question: {question}\n\n"
+    "JSON object must include at least the 'answer' field in plain text (no markdown). "
+    "If the information is missing in the context, set missing_info=true and set answer to a short, engaging acknowledgement such as "
+    "\"I'm not sure\", \"I don't have an idea about that yet\", or \"I don't have that info handy right now\" (vary phrasing across turns). "
+    "If academic scores/percentages/CGPA are included, avoid bare numbers and phrase them naturally (e.g., \"I scored 88.5% in PU\", \"I finished with an 8.3 CGPA\")."
+)
+
+
+class _QueryBatcher:
+    """Coalesce concurrent query encodes into one batched forward pass on a background thread.
+    A batch is encoded once it holds max_batch queries or max_wait_s has passed since its first query.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], max_batch: int = 16, max_wait_s: float = 0.01):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self._queue: "queue.Queue[tuple[str, Future] | None]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        # Guards thread start and close, so nothing is queued behind the stop sentinel
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            if not self._closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rag-query-encoder", daemon=True)
+                    self._thread.start()
+                self._queue.put((text, fut))
+                return fut
+        # Closed (a turn still running on a replaced agent): encode inline
+        try:
+            fut.set_result(self.encode_batch([text])[0])
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def close(self) -> None:
+        """Stop the encoder thread once the queries already queued are done."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Stop after this batch
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                vecs = self.encode_batch([text for text, _ in batch])
+                for i, (_, fut) in enumerate(batch):
+                    fut.set_result(vecs[i])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+
+
+class AgentState(TypedDict, total=False):
     messages: List[Any]
     context: str
     session_id: str
+    # The turn's user message, set by chat(); states built elsewhere fall back to scanning messages
+    question: str
+    # Recent-conversation transcript, built once per turn for both retrieval and the prompt
+    transcript: str
+    # This turn's AIMessage, set by generate_response
+    reply: Any
 
 
 class RAGAgent:
@@ -28,47 +335,143 @@ class RAGAgent:
         self.model_name = model_name
         self.openrouter_api_key = openrouter_api_key or os.environ.get("OPENROUTER_API_KEY")
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        # Local encoder for retrieval (fast and free)
-        self.st_model = SentenceTransformer("all-MiniLM-L6-v2")
-        # Precompute embeddings for all stored chunks once
-        self.chunks: List[str] = []
-        self.chunk_embeddings = None
+        # Keep-alive pool so turns and model fallbacks reuse the TLS connection to OpenRouter; failed
+        # connects (e.g. a reset idle socket) are retried, failed completions go to the hedged fallbacks
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                                 max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)))
+        self._http_last_used = 0.0
+        # Contiguous (N, d) copy of the stored chunk vectors, read back from the FAISS index
+        # (no re-encode) and kept as int8 or float32 per RAG_CHUNK_DTYPE, plus the documents in index order
+        self.chunk_docs: List[Any] = []
+        self.chunk_matrix: np.ndarray | None = None
+        # Inverse row norms of the int8 matrix (float32 rows are stored unit-length)
+        self.chunk_inv_norms: np.ndarray | None = None
         try:
-            # Extract all documents from the LangChain FAISS docstore
-            docs = []
-            if hasattr(self.vector_store, "docstore") and hasattr(self.vector_store.docstore, "_dict"):
-                docs = list(self.vector_store.docstore._dict.values())
-            self.chunks = [getattr(d, "page_content", None) for d in docs if getattr(d, "page_content", None)]
-            if self.chunks:
-                self.chunk_embeddings = self.st_model.encode(self.chunks, convert_to_tensor=True)
+            self._load_chunk_matrix()
         except Exception as e:
-            print(f"[RAG] Failed to precompute chunk embeddings: {e}")
-        self.session_memory: Dict[str, List] = {}
+            print(f"[RAG] Failed to load chunk matrix from FAISS index, using similarity_search: {e}")
+            self.chunk_docs = []
+            self.chunk_matrix = None
+        # Recent turns per session (Redis when REDIS_URL is set); prompts only read the last few,
+        # the full history lives in the DB
+        self.session_store = make_session_store(SESSION_MEMORY_MAXLEN)
         self.session_flags: Dict[str, Dict[str, Any]] = {}
         # Lightweight diagnostics per session (retrieved sources, missing flags, etc.)
         self.session_diagnostics: Dict[str, Dict[str, Any]] = {}
+        # LRU of query embeddings keyed by sha256(query), so repeated questions skip the encoder
+        self._qemb_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._qemb_cache_size = 512
+        # Same keys -> top-k chunks, so repeated questions also skip the search; shares the lock above
+        self._ctx_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._qemb_lock = threading.Lock()
+        self._query_batcher = _QueryBatcher(self._embed_query_batch, QUERY_BATCH_MAX, QUERY_BATCH_WAIT_S)
+        # Semantic response cache: ring of (unit embedding of question||context, entertainment flag, answer)
+        self._resp_cache: deque = deque(maxlen=RESPONSE_CACHE_SIZE)
+        # The response schema is constant; build and serialize it once
+        self._schema = self._assistant_json_schema()
+        self._schema_str = _json_dumps(self._schema).decode("utf-8")
+        self._schema_prompt = f"JSON Schema (enforced): {self._schema_str}"
+        # Per-turn constants: the two persona variants, request headers and fallback model order
+        self._system_instructions = {flag: _SYSTEM_PROMPT_TPL.format(ent_flag=str(flag).lower()) for flag in (False, True)}
+        self._headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        if self.openrouter_api_key:
+            self._headers["Authorization"] = f"Bearer {self.openrouter_api_key}"
+        # Optional but recommended headers per OpenRouter docs
+        if os.environ.get("OPENROUTER_SITE_URL"):
+            self._headers["HTTP-Referer"] = os.environ["OPENROUTER_SITE_URL"]
+        if os.environ.get("OPENROUTER_APP_NAME"):
+            self._headers["X-Title"] = os.environ["OPENROUTER_APP_NAME"]
+        # Build candidate model list: configured -> env fallbacks -> a safe default
+        fallback_env = os.environ.get("OPENROUTER_FALLBACK_MODELS", "")
+        fallback_models = [m.strip() for m in fallback_env.split(",") if m.strip()]
+        self._candidates: List[str] = []
+        for m in [self.model_name, *fallback_models, "openai/gpt-oss-20b:free"]:
+            if m and m not in self._candidates:
+                self._candidates.append(m)
+        # Open the OpenRouter connection in the background so the first turn skips the TLS handshake
+        threading.Thread(target=self._warm_connection, name="openrouter-warmup", daemon=True).start()
+        # Likewise run one encode (lazy init, kernel selection) before the first user query
+        threading.Thread(target=self._warm_encoder, name="rag-encoder-warmup", daemon=True).start()
+
+    def _load_chunk_matrix(self) -> None:
+        """Populate chunk_docs/chunk_matrix, mmapping a shared on-disk copy when one exists."""
+        store = self.vector_store
+        n = int(store.index.ntotal)
+        # Past ANN_MIN_CHUNKS the FAISS index searches faster than a full scan; skip the copy
+        if not n or n >= ANN_MIN_CHUNKS:
+            return
+        ids = [store.index_to_docstore_id[i] for i in range(n)]
+        self.chunk_docs = [store.docstore.search(i) for i in ids]
+
+        # Stable key over the chunk set, storage precision and layout (rows L2-normalized)
+        h = hashlib.sha256(f"{CHUNK_DTYPE}:unit:{store.index.d}".encode())
+        for doc_id, doc in zip(ids, self.chunk_docs):
+            h.update(str(doc_id).encode("utf-8"))
+            h.update(getattr(doc, "page_content", str(doc)).encode("utf-8"))
+        path = Path(CHUNK_CACHE_DIR) / f"emb_{h.hexdigest()[:32]}.npy"
+
+        mat = None
+        if path.exists():
+            try:
+                mat = np.load(path, mmap_mode="r")
+                if mat.shape != (n, store.index.d):
+                    mat = None
+            except Exception as e:
+                print(f"[RAG] Ignoring unreadable chunk matrix {path}: {e}")
+                mat = None
+        if mat is None:
+            mat = np.ascontiguousarray(store.index.reconstruct_n(0, n), dtype=np.float32)
+            if CHUNK_DTYPE == "int8":
+                mat, _ = _quantize_i8(mat)
+            else:
+                # Unit rows turn cosine into a single dot product (BLAS sgemv) per query
+                mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+                if CHUNK_DTYPE == "float16":
+                    mat = mat.astype(np.float16)
+            try:
+                # Write-then-rename so concurrently starting workers never see a partial file
+                fd, tmp = tempfile.mkstemp(dir=CHUNK_CACHE_DIR, suffix=".npy")
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, mat)
+                os.replace(tmp, path)
+                mat = np.load(path, mmap_mode="r")
+            except Exception as e:
+                print(f"[RAG] Could not persist chunk matrix, keeping it in memory: {e}")
+            else:
+                # Matrices of earlier chunk sets would otherwise pile up in tmpfs (RAM). Workers that
+                # still mmap one keep their mapping; unlinking only drops the name
+                for old in Path(CHUNK_CACHE_DIR).glob("emb_" + "?" * 32 + ".npy"):
+                    if old != path:
+                        try:
+                            old.unlink()
+                        except OSError:
+                            pass
+        self.chunk_matrix = mat
+        if mat.dtype == np.int8:
+            self.chunk_inv_norms = 1.0 / np.maximum(np.linalg.norm(mat.astype(np.float32), axis=1), 1e-12)
 
     def retrieve_context(self, state: AgentState) -> AgentState:
-        """Retrieve relevant context using sentence-transformers (cosine sim).
+        """Retrieve relevant context by cosine similarity over the stored chunk vectors.
         Uses recent conversation to build a better retrieval query so follow-ups like
         "From where?" are grounded in the prior turn.
         """
         messages = state["messages"]
         session_id = state.get("session_id", "")
-        last_user = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
-        query = last_user.content if last_user else ""
+        query = state.get("question")
+        if query is None:
+            last_user = _last_user(messages)
+            query = last_user.content if last_user else ""
 
         # Build a conversation-aware query for retrieval
         try:
-            # Gather a short window of recent messages (up to last 4)
-            recent = messages[-4:]
-            lines: List[str] = []
-            for m in recent:
-                if isinstance(m, HumanMessage):
-                    lines.append(f"User: {m.content}")
-                elif isinstance(m, AIMessage):
-                    lines.append(f"Assistant: {m.content}")
-            convo = "\n".join(lines)
+            # Short window of recent messages (up to last 4)
+            convo = state.get("transcript")
+            if convo is None:
+                convo = state["transcript"] = _transcript(messages)
 
             # Heuristic: if this looks like a short follow-up, include recent convo
             q_low = (query or "").strip().lower()
@@ -82,33 +485,18 @@ class RAGAgent:
         context = ""
         retrieved_sources: List[str] = []
         try:
-            if self.chunks and self.chunk_embeddings is not None:
-                query_embedding = self.st_model.encode(retrieval_query, convert_to_tensor=True)
-                scores = cos_sim(query_embedding, self.chunk_embeddings)
-                # scores shape: (1, N)
-                k = min(3, len(self.chunks))
-                top_idx = scores.squeeze(0).argsort(descending=True)[:k]
-                selected = [self.chunks[int(i)] for i in top_idx]
-                # Parse filenames from the header line 'Source: <filename> (<typ>)' added in init_rag
-                for chunk in selected:
-                    first_line = (chunk or "").splitlines()[0] if chunk else ""
-                    m = re.match(r"^Source:\s*([^\(\n]+)\s*\(", first_line)
-                    if m:
-                        retrieved_sources.append(m.group(1).strip())
-                context = "\n\n".join(selected)
-            else:
-                # Fallback to FAISS search if precomputed chunks missing
-                docs = self.vector_store.similarity_search(retrieval_query, k=3)
-                for doc in docs:
-                    meta = getattr(doc, "metadata", {}) or {}
-                    fname = meta.get("filename") or meta.get("source") or "unknown"
-                    # Normalize path to basename
-                    try:
-                        fname = Path(fname).name
-                    except Exception:
-                        pass
-                    retrieved_sources.append(str(fname))
-                context = "\n\n".join([doc.page_content for doc in docs])
+            # Filler carries nothing to search for; skip the encoder and the search
+            docs = () if _SMALL_TALK_RE.match(query or "") else self._search(retrieval_query)
+            for doc in docs:
+                meta = getattr(doc, "metadata", {}) or {}
+                fname = meta.get("filename") or meta.get("source") or "unknown"
+                # Normalize path to basename
+                try:
+                    fname = Path(fname).name
+                except Exception:
+                    pass
+                retrieved_sources.append(str(fname))
+            context = "\n\n".join([doc.page_content for doc in docs])
         except Exception as e:
             print(f"[RAG] retrieve_context error, falling back to empty context: {e}")
 
@@ -122,18 +510,90 @@ class RAGAgent:
             pass
         return state
 
+    def _search(self, retrieval_query: str) -> List[Any]:
+        """Top-3 chunks for a retrieval query; repeated queries skip both the encode and the search."""
+        key = hashlib.sha256(retrieval_query.encode("utf-8")).digest()
+        with self._qemb_lock:
+            docs = self._ctx_cache.get(key)
+            if docs is not None:
+                self._ctx_cache.move_to_end(key)
+                return docs
+        query_vec = self._encode_query(retrieval_query)
+        if self.chunk_matrix is None:
+            # Large corpora (or no matrix): graph search in the FAISS index
+            docs = self.vector_store.similarity_search_by_vector((query_vec / (np.linalg.norm(query_vec) or 1.0)).tolist(), k=3)
+        else:
+            dist = self._cosine_distances(query_vec)
+            k = min(3, len(self.chunk_docs))
+            # O(N) selection of the k nearest, then order just those k
+            top_idx = np.argpartition(dist, k - 1)[:k] if k < len(dist) else np.arange(len(dist))
+            top_idx = top_idx[np.argsort(dist[top_idx])]
+            docs = [self.chunk_docs[int(i)] for i in top_idx]
+        docs = tuple(docs)
+        with self._qemb_lock:
+            self._ctx_cache[key] = docs
+            if len(self._ctx_cache) > self._qemb_cache_size:
+                self._ctx_cache.popitem(last=False)
+        return docs
+
+    def _embed_query_batch(self, texts: List[str]) -> np.ndarray:
+        """Query embeddings as a (B, d) ndarray in one forward pass, skipping LangChain's list round trip
+        when the encoder is known."""
+        emb = self.vector_store.embedding_function
+        encode = getattr(emb, "_encode", None)  # OnnxMiniLMEmbeddings
+        if callable(encode):
+            return encode(texts)
+        client = getattr(emb, "client", None)  # SentenceTransformerEmbeddings
+        if client is not None and hasattr(client, "encode"):
+            kwargs = dict(getattr(emb, "encode_kwargs", None) or {})
+            kwargs.update(convert_to_numpy=True, convert_to_tensor=False, show_progress_bar=False, batch_size=len(texts))
+            return client.encode(texts, **kwargs)
+        return np.asarray([emb.embed_query(t) for t in texts])
+
+    def _encode_query(self, text: str) -> np.ndarray:
+        """Embed a retrieval query, reusing cached embeddings for repeated text."""
+        key = hashlib.sha256(text.encode("utf-8")).digest()
+        with self._qemb_lock:
+            vec = self._qemb_cache.get(key)
+            if vec is not None:
+                self._qemb_cache.move_to_end(key)
+                return vec
+        # Concurrent turns share one batched encode
+        vec = np.asarray(self._query_batcher.submit(text).result(), dtype=np.float32)
+        vec.setflags(write=False)
+        with self._qemb_lock:
+            self._qemb_cache[key] = vec
+            if len(self._qemb_cache) > self._qemb_cache_size:
+                self._qemb_cache.popitem(last=False)
+        return vec
+
+    def _cosine_distances(self, query_vec: np.ndarray) -> np.ndarray:
+        """Cosine distance (1 - cos) from the query to every chunk, shape (N,)."""
+        if self.chunk_matrix.dtype == np.int8:
+            # Cosine is scale-invariant, so the query only needs its own symmetric int8 scale
+            q_scale = 127.0 / (float(np.abs(query_vec).max()) or 1.0)
+            query_i8 = np.clip(np.round(query_vec * q_scale), -127, 127).astype(np.int8)
+            if simsimd is not None:
+                # int8 kernels (VNNI vpdpbusd / NEON sdot)
+                return np.asarray(simsimd.cdist(query_i8[None, :], self.chunk_matrix, metric="cosine")).reshape(-1)
+            query_vec = query_i8.astype(np.float32)
+            sims = (self.chunk_matrix @ query_vec) * self.chunk_inv_norms / (np.linalg.norm(query_vec) or 1.0)
+            return 1.0 - sims
+        # Rows are unit-length: normalize the query and score with one matrix-vector product
+        query_vec = query_vec / (np.linalg.norm(query_vec) or 1.0)
+        if self.chunk_matrix.dtype == np.float16:
+            if simsimd is not None:
+                return np.asarray(simsimd.cdist(query_vec.astype(np.float16)[None, :], self.chunk_matrix, metric="cosine")).reshape(-1)
+            # NumPy has no fast f16 matvec; upcast for BLAS
+            return 1.0 - self.chunk_matrix.astype(np.float32) @ query_vec
+        return 1.0 - self.chunk_matrix @ query_vec
+
     def _format_prompt(self, system_prompt: str, messages: List[Any]) -> str:
         """Flatten chat history into a single prompt for text-generation models."""
         lines: List[str] = [system_prompt.strip(), "", "Conversation:"]
-        for msg in messages[-5:]:
-            role = None
-            content = None
-            if isinstance(msg, HumanMessage) or getattr(msg, 'role', None) == 'user':
-                role = "User"
-                content = msg.content if hasattr(msg, 'content') else str(msg)
-            elif isinstance(msg, AIMessage) or getattr(msg, 'role', None) == 'assistant':
-                role = "Assistant"
-                content = msg.content if hasattr(msg, 'content') else str(msg)
+        for msg in list(messages)[-5:]:
+            role = _role_of(msg)
+            content = msg.content if hasattr(msg, 'content') else str(msg)
             if role and content:
                 lines.append(f"{role}: {content}")
         lines.append("Assistant:")
@@ -142,10 +602,11 @@ class RAGAgent:
     def _assistant_json_schema(self) -> dict:
         return {
             "type": "object",
+            # missing_info precedes answer so it has already arrived when streaming stops at the answer
             "properties": {
+                "missing_info": {"type": "boolean", "description": "True if the provided context did not contain the requested information."},
                 "answer": {"type": "string", "description": "Final, user-visible answer in plain text."},
                 "confidence": {"type": "number", "minimum": 0, "maximum": 1, "description": "Model self-rated confidence for the answer."},
-                "missing_info": {"type": "boolean", "description": "True if the provided context did not contain the requested information."},
                 "followups": {"type": "array", "items": {"type": "string"}, "description": "Optional short follow-up suggestions for the user."},
                 "citations": {
                     "type": "array",
@@ -165,6 +626,46 @@ class RAGAgent:
             "additionalProperties": False
         }
 
+    def _read_stream(self, resp: requests.Response, cancel: threading.Event | None = None,
+                     on_delta: Callable[[str], None] | None = None,
+                     first_delta: threading.Event | None = None) -> tuple[str, dict | None]:
+        """Accumulate OpenRouter SSE content deltas. Returns (content, obj) where obj holds the
+        answer (and missing_info, if already seen) once the answer string has closed, else None.
+        on_delta, if given, receives each new piece of answer text as it arrives; first_delta,
+        if given, is set when the first content delta arrives."""
+        parts: List[str] = []
+        emitted = 0
+        for line in resp.iter_lines(decode_unicode=True):
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("cancelled (another model answered first)")
+            # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments carry no data
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = _json_loads(data)
+            if chunk.get("error"):
+                raise RuntimeError(f"provider error: {chunk.get('error')}")
+            choices = chunk.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if not delta:
+                continue
+            if first_delta is not None and not parts:
+                first_delta.set()
+            parts.append(delta)
+            if on_delta is not None:
+                partial = _partial_answer("".join(parts))
+                if len(partial) > emitted:
+                    on_delta(partial[emitted:])
+                    emitted = len(partial)
+            if '"' in delta:
+                content = "".join(parts)
+                obj = _early_answer(content)
+                if obj is not None:
+                    return content, obj
+        return "".join(parts), None
+
     def _parse_structured_response(self, raw: str) -> dict:
         if not raw:
             return {}
@@ -172,7 +673,7 @@ class RAGAgent:
         if s.startswith("```"):
             s = s.strip("`\n ")
         try:
-            obj = json.loads(s)
+            obj = _json_loads(s)
             if isinstance(obj, dict):
                 return obj
         except json.JSONDecodeError:
@@ -181,140 +682,227 @@ class RAGAgent:
             if start != -1 and end != -1 and end > start:
                 snippet = s[start:end+1]
                 try:
-                    obj = json.loads(snippet)
+                    obj = _json_loads(snippet)
                     if isinstance(obj, dict):
                         return obj
                 except Exception:
                     pass
         return {"answer": self._clean_text(s)}
 
-    def generate_response(self, state: AgentState) -> AgentState:
-        """Generate response via OpenRouter with enforced structured JSON output and robust provider error handling/fallback."""
+    def _call_model(self, model: str, headers: Dict[str, str], prompt_messages: List[Dict[str, str]],
+                    cancel: threading.Event, on_delta: Callable[[str], None] | None = None,
+                    first_delta: threading.Event | None = None) -> tuple[str, dict | None]:
+        """One OpenRouter attempt. Returns (content, obj-if-streamed-early); raises with a short reason on failure.
+        first_delta, if given, is set once the model starts streaming content."""
+        payload = {
+            "model": model,
+            "temperature": 0.9,
+            "top_p": 0.95,
+            "max_tokens": 1000,
+            "frequency_penalty": 0.25,
+            "presence_penalty": 0.1,
+            "stream": True,
+            "messages": prompt_messages,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "assistant_response",
+                    "schema": self._schema,
+                    "strict": True
+                }
+            }
+        }
+
+        # A queued hedge may only get a worker after another model has already answered
+        if cancel.is_set():
+            raise RuntimeError("cancelled (another model answered first)")
+        try:
+            resp = self._http.post(self.api_url, headers=headers, data=_json_dumps(payload), timeout=120, stream=True)
+        except Exception as e:
+            raise RuntimeError(f"request error: {e}")
+        self._http_last_used = time.monotonic()
+
+        # Treat 5xx as transient capacity errors; try next model
+        if resp.status_code >= 500:
+            resp.close()
+            raise RuntimeError(f"HTTP {resp.status_code}")
+
+        obj = None
+        if "text/event-stream" in resp.headers.get("Content-Type", ""):
+            # Read SSE deltas and stop as soon as the answer string is complete
+            try:
+                content, obj = self._read_stream(resp, cancel, on_delta, first_delta)
+            except Exception as e:
+                raise RuntimeError(f"stream error: {e}")
+            finally:
+                resp.close()
+        else:
+            # Some providers return a plain JSON body (often with an error) even when streaming is requested
+            try:
+                data = _json_loads(resp.content)
+            except Exception as e:
+                raise RuntimeError(f"invalid JSON: {e}")
+
+            if isinstance(data, dict) and data.get("error"):
+                # capacity or routing errors should fall through to next model
+                raise RuntimeError(f"provider error: {data.get('error')}")
+
+            choices = data.get("choices")
+            if not choices or not isinstance(choices, list) or not choices:
+                raise RuntimeError("missing choices")
+
+            content = choices[0].get("message", {}).get("content")
+
+        if not content:
+            raise RuntimeError("empty content")
+        return content, obj
+
+    def generate_response(self, state: AgentState, on_delta: Callable[[str], None] | None = None,
+                          on_reset: Callable[[], None] | None = None) -> AgentState:
+        """Generate response via OpenRouter with enforced structured JSON output and robust provider error handling/fallback.
+        on_delta, if given, receives answer text as it streams in (raw; the final message is post-processed).
+        on_reset, if given, is called when the streaming model fails after emitting text: nothing more
+        streams and the final message comes from another model."""
         context = state.get("context", "")
         messages = state["messages"]
         # Last user question
-        last_user = next((m for m in reversed(messages) if isinstance(m, HumanMessage) or getattr(m, 'role', None) == 'user'), None)
-        question = last_user.content if last_user and hasattr(last_user, 'content') else ""
+        question = state.get("question")
+        if question is None:
+            last_user = _last_user(messages)
+            question = last_user.content if last_user and hasattr(last_user, 'content') else ""
         session_id = state.get("session_id", "")
         ent_flag = bool(self.session_flags.get(session_id, {}).get("entertainment_mentioned"))
 
-        # System instructions and schema
-        schema = self._assistant_json_schema()
-        system_instructions = (
-            "You are Tejas M. Reply as a friendly human in first person. "
-            "Keep answers short (2–3 sentences) unless the user explicitly asks for more. "
-            "Be confident and conversational; vary phrasing so it never feels templated. "
-            "Ground your answer in the provided Context when relevant; if the answer is not in the Context, acknowledge it briefly in a natural way (e.g., \"I'm not sure\", \"I don't have an idea about that yet\", or \"I don't have that info handy right now\"). Vary the wording across turns. "
-            "When mentioning academic scores/percentages/CGPA, avoid bare numbers—prefer phrasing like \"I scored 88.5% in PU\" or \"I finished with an 8.3 CGPA.\" "
-            "Canonical profile: You are a full‑stack engineer (frontend and backend). When discussing your work at Fynd, explicitly describe full‑stack responsibilities; never imply you handled only frontend. "
-            "For questions about what you're working on now, treat your current focus (ratl.ai) as canonical—even if it isn't present in the retrieved Context—answer with that first. Mention the AI portfolio manager only if explicitly asked or if the user asks for side projects, keep it brief, and point people to https://ratl.ai for details. "
-            "Playful entertainment note: you enjoy anime and good TV dramas; mention this casually and only when relevant. "
-            "Do not repeat it across messages. "
-            "If entertainment_mentioned_in_session is true, avoid bringing it up again unless the user asks directly. "
-            f"entertainment_mentioned_in_session={str(ent_flag).lower()}. "
-            "You MUST output a single JSON object that conforms to the provided JSON Schema. Do not include any text before or after the JSON."
-        )
+        # System instructions and schema are precomputed in __init__
+        system_instructions = self._system_instructions[ent_flag]
         # Build a short, recent conversation transcript to help resolve anaphora
-        recent = messages[-4:]
-        convo_lines: List[str] = []
-        for m in recent:
-            if isinstance(m, HumanMessage):
-                convo_lines.append(f"User: {m.content}")
-            elif isinstance(m, AIMessage):
-                convo_lines.append(f"Assistant: {m.content}")
-        convo_text = "\n".join(convo_lines)
-
-        user_prompt = (
-            "Follow the instructions and return a JSON object only.\n"
-            f"entertainment_mentioned_in_session: {str(ent_flag).lower()}\n\n"
-            f"Conversation (recent):\n{convo_text}\n\n"
-            f"Context:\n{context}\n\n"
-            f"Question: {question}\n\n"
-            "JSON object must include at least the 'answer' field in plain text (no markdown). "
-            "If the information is missing in the context, set missing_info=true and set answer to a short, engaging acknowledgement such as "
-            "\"I'm not sure\", \"I don't have an idea about that yet\", or \"I don't have that info handy right now\" (vary phrasing across turns). "
-            "If academic scores/percentages/CGPA are included, avoid bare numbers and phrase them naturally (e.g., \"I scored 88.5% in PU\", \"I finished with an 8.3 CGPA\")."
+        convo_text = state.get("transcript")
+        if convo_text is None:
+            convo_text = _transcript(messages)
+
+        user_prompt = _USER_PROMPT_TPL.format(
+            ent_flag=str(ent_flag).lower(), convo=convo_text, context=context, question=question,
         )
 
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-        }
-        if self.openrouter_api_key:
-            headers["Authorization"] = f"Bearer {self.openrouter_api_key}"
-        # Optional but recommended headers per OpenRouter docs
-        if os.environ.get("OPENROUTER_SITE_URL"):
-            headers["HTTP-Referer"] = os.environ["OPENROUTER_SITE_URL"]
-        if os.environ.get("OPENROUTER_APP_NAME"):
-            headers["X-Title"] = os.environ["OPENROUTER_APP_NAME"]
-
-        # Build candidate model list: configured -> env fallbacks -> a safe default
-        fallback_env = os.environ.get("OPENROUTER_FALLBACK_MODELS", "")
-        fallback_models = [m.strip() for m in fallback_env.split(",") if m.strip()]
-        candidates: List[str] = []
-        for m in [self.model_name, *fallback_models, "openai/gpt-oss-20b:free"]:
-            if m and m not in candidates:
-                candidates.append(m)
+        headers = self._headers
+        candidates = self._candidates
 
         errors: List[str] = []
 
-        for model in candidates:
-            payload = {
-                "model": model,
-                "temperature": 0.9,
-                "top_p": 0.95,
-                "max_tokens": 1000,
-                "frequency_penalty": 0.25,
-                "presence_penalty": 0.1,
-                "messages": [
-                    {"role": "system", "content": system_instructions},
-                    {"role": "system", "content": f"JSON Schema (enforced): {json.dumps(schema)}"},
-                    {"role": "user", "content": user_prompt},
-                ],
-                "response_format": {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "assistant_response",
-                        "schema": schema,
-                        "strict": True
-                    }
-                }
-            }
+        # Near-duplicate (question, context) pairs reuse a recent answer and skip the OpenRouter round trip
+        cache_key_vec = None
+        try:
+            cache_key_vec = self._encode_query(f"{question}||{context[:512]}")
+            cached = self._lookup_response(cache_key_vec, ent_flag)
+            if cached is not None:
+                if on_delta is not None:
+                    on_delta(cached)
+                self._note_entertainment(session_id, ent_flag, cached)
+                state["reply"] = AIMessage(content=cached)
+                state["messages"].append(state["reply"])
+                return state
+        except Exception as e:
+            print(f"[RAG] response cache lookup failed: {e}")
 
-            try:
-                resp = requests.post(self.api_url, headers=headers, json=payload, timeout=120)
-            except Exception as e:
-                errors.append(f"{model}: request error: {e}")
-                continue
+        # Only "model" varies between attempts
+        prompt_messages = [
+            {"role": "system", "content": system_instructions},
+            {"role": "system", "content": self._schema_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
 
-            # Treat 5xx as transient capacity errors; try next model
-            if resp.status_code >= 500:
-                errors.append(f"{model}: HTTP {resp.status_code}")
-                continue
+        # Hedged fallbacks: the next candidate fires when the current ones error, or when none of them has
+        # streamed any content within HEDGE_DELAY_S; the first usable reply wins and the others are told to stop reading
+        cancel = threading.Event()
+        pending: Dict[Any, str] = {}
+        # Set per attempt when its first content delta arrives
+        first_deltas: Dict[Any, threading.Event] = {}
+        remaining = iter(candidates)
+        content, obj = None, None
 
-            # Some providers return 200 with an error body
-            try:
-                data = resp.json()
-            except Exception as e:
-                errors.append(f"{model}: invalid JSON: {e}")
-                continue
+        # With hedging several models may stream at once; only the first one to emit text is forwarded,
+        # and its answer is the one returned. "" marks a stream that was reset after its model failed
+        streaming_model: List[str] = []
+        claim_lock = threading.Lock()
+        # Answers from models that finished while another one held the stream, kept as fallbacks
+        finished: List[tuple[str, dict | None]] = []
 
-            if isinstance(data, dict) and data.get("error"):
-                errors.append(f"{model}: provider error: {data.get('error')}")
-                # capacity or routing errors should fall through to next model
-                continue
+        def delta_for(model: str) -> Callable[[str], None] | None:
+            if on_delta is None:
+                return None
 
-            choices = data.get("choices")
-            if not choices or not isinstance(choices, list) or not choices:
-                errors.append(f"{model}: missing choices")
-                continue
+            def forward(text: str) -> None:
+                with claim_lock:
+                    if not streaming_model:
+                        streaming_model.append(model)
+                    if streaming_model[0] != model:
+                        return
+                on_delta(text)
+            return forward
 
-            content = choices[0].get("message", {}).get("content")
-            if not content:
-                errors.append(f"{model}: empty content")
-                continue
+        def fire() -> None:
+            model = next(remaining, None)
+            if model is not None:
+                started = threading.Event()
+                fut = _HEDGE_POOL.submit(self._call_model, model, headers, prompt_messages, cancel, delta_for(model), started)
+                pending[fut] = model
+                first_deltas[fut] = started
+
+        def streaming() -> bool:
+            return any(first_deltas[fut].is_set() for fut in pending)
 
-            obj = self._parse_structured_response(content)
+        def may_answer(model: str) -> bool:
+            # A finished model wins unless another one is streaming its text to the client
+            with claim_lock:
+                if not streaming_model:
+                    streaming_model.append(model)
+                return streaming_model[0] in (model, "")
+
+        def lost_stream(model: str) -> bool:
+            with claim_lock:
+                if streaming_model and streaming_model[0] == model:
+                    streaming_model[0] = ""
+                    return True
+                return False
+
+        try:
+            fire()
+            while content is None and pending:
+                # A model that is already streaming is slow, not stuck: wait for it rather than hedge
+                done, _ = wait(list(pending), timeout=None if streaming() else HEDGE_DELAY_S, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    model = pending.pop(fut)
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        errors.append(f"{model}: {e}")
+                        if lost_stream(model):
+                            # The client has part of this model's answer; have it drop that text
+                            if on_reset is not None:
+                                on_reset()
+                            if finished:
+                                content, obj = finished.pop(0)
+                                break
+                        continue
+                    if may_answer(model):
+                        content, obj = result
+                        break
+                    finished.append(result)
+                if content is None and (done or not streaming()):
+                    # Failed, or nothing streamed before the deadline: hedge with the next candidate
+                    fire()
+        finally:
+            cancel.set()
+
+        if content is not None:
+            if obj is None:
+                # Strict json_schema output is plain JSON; only lenient providers need the repair path
+                try:
+                    obj = _json_loads(content)
+                    if not isinstance(obj, dict) or not isinstance(obj["answer"], str):
+                        raise ValueError("answer missing")
+                except (ValueError, KeyError):
+                    obj = self._parse_structured_response(content)
             answer = obj.get("answer")
             text = self._clean_text(answer) if isinstance(answer, str) else self._to_display_text(content)
             text = self._apply_invariants(question, text)
@@ -326,43 +914,45 @@ class RAGAgent:
                     self.session_diagnostics[session_id]["missing_info"] = bool(obj.get("missing_info"))
             except Exception:
                 pass
-            # Update session entertainment flag if mentioned in this answer
-            try:
-                if not ent_flag:
-                    low = (text or "").lower()
-                    if any(k in low for k in [
-                        "anime",
-                        "one piece", "naruto", "bleach", "jujutsu kaisen", "tokyo revengers",
-                        "fullmetal alchemist", "demon slayer", "black clover",
-                        "breaking bad", "dark", "prison break", "money heist"
-                    ]):
-                        self.session_flags.setdefault(session_id, {})["entertainment_mentioned"] = True
-            except Exception:
-                pass
-            state["messages"].append(AIMessage(content=text))
+            self._note_entertainment(session_id, ent_flag, text)
+            if cache_key_vec is not None:
+                self._resp_cache.append((cache_key_vec / (np.linalg.norm(cache_key_vec) or 1.0), ent_flag, text))
+            state["reply"] = AIMessage(content=text)
+            state["messages"].append(state["reply"])
             return state
 
         # If all attempts failed, return a friendly message instead of raw provider error
         print(f"[RAG] All model attempts failed: {errors}")
         text = "I’m at capacity right now. Please try again in a moment."
-        state["messages"].append(AIMessage(content=text))
+        state["reply"] = AIMessage(content=text)
+        state["messages"].append(state["reply"])
         return state
 
+    def _lookup_response(self, key_vec: np.ndarray, ent_flag: bool) -> str | None:
+        """Return a cached answer whose key is at least RESPONSE_CACHE_THRESHOLD cosine-similar, if any."""
+        entries = [e for e in self._resp_cache if e[1] == ent_flag]
+        if not entries:
+            return None
+        mat = np.stack([e[0] for e in entries])
+        q = key_vec / (np.linalg.norm(key_vec) or 1.0)
+        if simsimd is not None:
+            sims = 1.0 - np.asarray(simsimd.cdist(q[None, :], mat, metric="cosine")).reshape(-1)
+        else:
+            sims = mat @ q
+        best = int(np.argmax(sims))
+        return entries[best][2] if sims[best] >= RESPONSE_CACHE_THRESHOLD else None
+
+    def _note_entertainment(self, session_id: str, ent_flag: bool, text: str) -> None:
+        """Update session entertainment flag if mentioned in this answer."""
+        try:
+            if not ent_flag and _ENT_RE.search(text or ""):
+                self.session_flags.setdefault(session_id, {})["entertainment_mentioned"] = True
+        except Exception:
+            pass
+
     def _clean_text(self, text: str) -> str:
         """Strip common special tokens BOS/EOS and model boundary markers."""
-        patterns = [
-            r"<\|begin[_\s]*of[_\s]*sentence\|>",
-            r"<\|end[_\s]*of[_\s]*sentence\|>",
-            r"<\|begin[_\s]*of[_\s]*text\|>",
-            r"<\|end[_\s]*of[_\s]*text\|>",
-            r"<s>", r"</s>",
-            r"<｜begin▁of▁sentence｜>",
-            r"<｜end▁of▁sentence｜>",
-        ]
-        out = text or ""
-        for p in patterns:
-            out = re.sub(p, "", out, flags=re.IGNORECASE)
-        return out.strip()
+        return _CLEAN_RE.sub("", text or "").strip()
 
     def _to_display_text(self, raw: str) -> str:
         """If the model returned JSON, show its message; otherwise show cleaned text."""
@@ -372,25 +962,28 @@ class RAGAgent:
         # Remove code fences
         if s.startswith("```"):
             s = s.strip("`\n ")
-        # Try parse as JSON (handles policy/error blocks)
-        try:
-            obj = json.loads(s)
-            if isinstance(obj, dict):
-                msg = obj.get("message") or obj.get("content") or s
-                return self._clean_text(str(msg))
-        except json.JSONDecodeError:
-            # Attempt to extract first JSON object if surrounded by extra text
-            start = s.find("{")
-            end = s.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                snippet = s[start:end+1]
-                try:
-                    obj = json.loads(snippet)
-                    if isinstance(obj, dict):
-                        msg = obj.get("message") or obj.get("content") or snippet
-                        return self._clean_text(str(msg))
-                except Exception:
-                    pass
+        # Try parse as JSON (handles policy/error blocks); plain prose, the usual case, skips the parser
+        if s[:1] in ("{", "["):
+            try:
+                obj = _json_loads(s)
+                if isinstance(obj, dict):
+                    msg = obj.get("message") or obj.get("content") or s
+                    return self._clean_text(str(msg))
+                return self._clean_text(s)
+            except json.JSONDecodeError:
+                pass
+        # Attempt to extract first JSON object if surrounded by extra text
+        start = s.find("{")
+        end = s.rfind("}")
+        if start != -1 and end > start:
+            snippet = s[start:end+1]
+            try:
+                obj = _json_loads(snippet)
+                if isinstance(obj, dict):
+                    msg = obj.get("message") or obj.get("content") or snippet
+                    return self._clean_text(str(msg))
+            except Exception:
+                pass
         # Fall back to cleaned plain text
         return self._clean_text(s)
 
@@ -399,47 +992,38 @@ class RAGAgent:
         if not text:
             return text
         try:
-            ql = (question or "").lower()
-            asks_current = any(
-                kw in ql
-                for kw in [
-                    "what are you doing these days",
-                    "what are you working on",
-                    "currently working",
-                    "these days",
-                    "what are you up to",
-                ]
-            )
-            mentions_side = any(
-                kw in ql
-                for kw in ["side project", "side projects", "secondary project", "hustle", "hustles", "side-project", "secondary projects"]
-            )
-
-            # Normalize "ratl ai" forms to "ratl.ai"
-            norm = re.sub(r"\bratl\s*\.?\s*ai\b", "ratl.ai", text, flags=re.IGNORECASE)
+            ql = question or ""
+            asks_current = _ASKS_CURRENT_RE.search(ql) is not None
+            mentions_side = _MENTIONS_SIDE_RE.search(ql) is not None
+
+            # Each pass only runs when its trigger word is present
+            norm = text
+            low = norm.lower()
+            if "ratl" in low:
+                # Normalize "ratl ai" forms to "ratl.ai"
+                norm = _RATL_NORM_RE.sub("ratl.ai", norm)
 
             if asks_current and not mentions_side:
-                # Strip any sentence that mixes in the portfolio manager so the answer stays focused on ratl.ai
-                norm = re.sub(r"(?i)([^.?!]*\bportfolio manager\b[^.?!]*[.?!])", " ", norm)
-                norm = re.sub(r"\s{2,}", " ", norm).strip()
+                if "portfolio manager" in low:
+                    # Strip any sentence that mixes in the portfolio manager so the answer stays focused on ratl.ai
+                    norm = _PORTFOLIO_SENTENCE_RE.sub(" ", norm)
+                    norm = _MULTI_SPACE_RE.sub(" ", norm).strip()
 
                 # Ensure ratl.ai is explicitly mentioned if missing after cleanup
-                if re.search(r"ratl\.ai", norm, flags=re.IGNORECASE) is None:
+                if "ratl.ai" not in norm.lower():
                     lead = "I'm working on ratl.ai at Fynd—an autonomous agentic SaaS app that automates the entire software testing process."
                     if norm and not norm.endswith("."):
                         norm = norm + "."
                     norm = f"{lead} {norm}".strip() if norm else lead
 
-            # Fix incorrect phrasing like "AI portfolio manager at ratl.ai"
-            norm = re.sub(
-                r"\b(ai\s+)?portfolio\s+manager\s+at\s*ratl\.ai\b",
-                "AI portfolio manager (personal side project)",
-                norm,
-                flags=re.IGNORECASE,
-            )
+            low = norm.lower()
+            if "ratl" in low:
+                # Fix incorrect phrasing like "AI portfolio manager at ratl.ai"
+                if "portfolio" in low:
+                    norm = _PORTFOLIO_AT_RATL_RE.sub("AI portfolio manager (personal side project)", norm)
 
-            # Remove stray "the ratl.ai" phrasing that can appear after replacements
-            norm = re.sub(r"\bthe\s+ratl\.ai\b", "ratl.ai", norm, flags=re.IGNORECASE)
+                # Remove stray "the ratl.ai" phrasing that can appear after replacements
+                norm = _THE_RATL_RE.sub("ratl.ai", norm)
 
             return self._clean_text(norm)
         except Exception:
@@ -454,65 +1038,140 @@ class RAGAgent:
     # Session persistence is DB-backed via server inserts; hydrate from DB when needed.
     # --------------------
 
-    def chat(self, message: str, session_id: str) -> str:
-        """Main chat method without langgraph: retrieve -> generate"""
-        # Hydrate from DB if not in memory
-        if session_id not in self.session_memory:
-            try:
-                rows = fetch_history(session_id)
-                msgs: List[Any] = []
-                for r in rows:
-                    if r.get("role") == "user":
-                        msgs.append(HumanMessage(content=r.get("content", "")))
-                    elif r.get("role") == "assistant":
-                        msgs.append(AIMessage(content=r.get("content", "")))
-                self.session_memory[session_id] = msgs
-            except Exception as e:
-                print(f"[RAG] Failed to hydrate history from DB: {e}")
-                self.session_memory[session_id] = []
+    def _recent_messages(self, session_id: str) -> List[Any]:
+        """A snapshot of the recent session messages, hydrated from the DB when the store has none."""
+        msgs = self.session_store.recent(session_id)
+        if msgs is not None:
+            return msgs
+        loaded: List[Any] = []
+        try:
+            for r in fetch_history(session_id):
+                if r.get("role") == "user":
+                    loaded.append(HumanMessage(content=r.get("content", "")))
+                elif r.get("role") == "assistant":
+                    loaded.append(AIMessage(content=r.get("content", "")))
+        except Exception as e:
+            print(f"[RAG] Failed to hydrate history from DB: {e}")
+            loaded = []
+        self.session_store.replace(session_id, loaded)
+        return loaded[-SESSION_MEMORY_MAXLEN:]
+
+    def _begin_turn(self, message: str, session_id: str) -> AgentState:
+        """Record the user message and build the pipeline state."""
         self.session_flags.setdefault(session_id, {"entertainment_mentioned": False})
+        messages = self._recent_messages(session_id)
 
-        # Add user message to in-memory history (DB insert is handled in server)
-        self.session_memory[session_id].append(HumanMessage(content=message))
+        # Add user message to session memory (DB insert is handled in server)
+        user_msg = HumanMessage(content=message)
+        self.session_store.append(session_id, user_msg)
+        # messages is this turn's own copy; concurrent turns in the session never see it
+        messages.append(user_msg)
 
-        # Prepare state
-        state: AgentState = {
-            "messages": self.session_memory[session_id].copy(),
+        # Retrieval and generation only read the history; generate_response sets the AI reply
+        return {
+            "messages": messages,
             "context": "",
             "session_id": session_id,
+            "question": message,
+            "transcript": _transcript(messages),
         }
 
+    def _end_turn(self, state: AgentState) -> str:
+        """Persist the AI reply to session memory (DB insert is handled in server) and return its text."""
+        reply = state["reply"]
+        self.session_store.append(state["session_id"], reply)
+        return reply.content
+
+    def _warm_encoder(self) -> None:
+        """Encode a throwaway query so model initialization isn't paid by the first user."""
+        try:
+            self._embed_query_batch(["warmup"])
+        except Exception as e:
+            print(f"[RAG] Encoder warm-up failed: {e}")
+
+    def _warm_connection(self) -> None:
+        """Open a pooled TLS connection to OpenRouter if the last one may have gone idle."""
+        now = time.monotonic()
+        if now - self._http_last_used < 30:
+            return
+        self._http_last_used = now
+        try:
+            self._http.head(self.api_url, timeout=5).close()
+        except Exception:
+            pass
+
+    def chat(self, message: str, session_id: str) -> str:
+        """Main chat method without langgraph: retrieve -> generate"""
+        state = self._begin_turn(message, session_id)
+
         # Pipeline: retrieve then generate
         state = self.retrieve_context(state)
         state = self.generate_response(state)
 
-        # Update session memory with AI response (DB insert is handled in server)
-        self.session_memory[session_id].append(state["messages"][-1])
-
         # Return the AI response
-        return state["messages"][-1].content
+        return self._end_turn(state)
 
-    def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
-        """Get chat history for a session (hydrates from DB if not cached)."""
-        if session_id not in self.session_memory:
+    async def achat(self, message: str, session_id: str) -> str:
+        """Async chat: runs off the event loop, overlapping retrieval with the OpenRouter connection setup."""
+        state = await asyncio.to_thread(self._begin_turn, message, session_id)
+        state, _ = await asyncio.gather(
+            asyncio.to_thread(self.retrieve_context, state),
+            asyncio.to_thread(self._warm_connection),
+        )
+        state = await asyncio.to_thread(self.generate_response, state)
+        return await asyncio.to_thread(self._end_turn, state)
+
+    async def achat_stream(self, message: str, session_id: str) -> AsyncIterator[tuple[str, str]]:
+        """Like achat, but yields ("delta", text) as the answer streams in, then ("final", reply).
+        A ("reset", "") event means the text streamed so far should be discarded."""
+        loop = asyncio.get_running_loop()
+        deltas: asyncio.Queue = asyncio.Queue()
+
+        state = await asyncio.to_thread(self._begin_turn, message, session_id)
+        state, _ = await asyncio.gather(
+            asyncio.to_thread(self.retrieve_context, state),
+            asyncio.to_thread(self._warm_connection),
+        )
+
+        def generate() -> AgentState:
             try:
-                rows = fetch_history(session_id)
-                msgs: List[Any] = []
-                for r in rows:
-                    if r.get("role") == "user":
-                        msgs.append(HumanMessage(content=r.get("content", "")))
-                    elif r.get("role") == "assistant":
-                        msgs.append(AIMessage(content=r.get("content", "")))
-                self.session_memory[session_id] = msgs
-            except Exception as e:
-                print(f"[RAG] Failed to hydrate history from DB: {e}")
-                self.session_memory[session_id] = []
+                return self.generate_response(
+                    state,
+                    lambda t: loop.call_soon_threadsafe(deltas.put_nowait, ("delta", t)),
+                    lambda: loop.call_soon_threadsafe(deltas.put_nowait, ("reset", "")),
+                )
+            finally:
+                loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+        task = asyncio.ensure_future(asyncio.to_thread(generate))
+        while (event := await deltas.get()) is not None:
+            yield event
+        state = await task
+        yield "final", await asyncio.to_thread(self._end_turn, state)
+
+    def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
+        """Get the full chat history for a session from the DB (memory only keeps recent turns)."""
+        try:
+            return [
+                {"role": r.get("role"), "content": r.get("content", "")}
+                for r in fetch_history(session_id)
+                if r.get("role") in ("user", "assistant")
+            ]
+        except Exception as e:
+            print(f"[RAG] Failed to load history from DB: {e}")
 
         history = []
-        for msg in self.session_memory[session_id]:
+        for msg in self.session_store.recent(session_id) or ():
             if isinstance(msg, HumanMessage):
                 history.append({"role": "user", "content": msg.content})
             elif isinstance(msg, AIMessage):
                 history.append({"role": "assistant", "content": msg.content})
 
         return history
+
+    def close(self) -> None:
+        """Release the agent's background threads once it has been replaced (e.g. after a reindex).
+        Turns still running on it finish; later query encodes run inline."""
+        self._query_batcher.close()
+        # Drops the idle keep-alive connections; a turn still posting through it opens a fresh pool
+        self._http.close()
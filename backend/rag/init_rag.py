@@ -1,14 +1,95 @@
 import os
+import hashlib
+import tempfile
 from pathlib import Path
 from typing import Any, Dict, List
 
+import faiss
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.embeddings import SentenceTransformerEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 
-from rag.agent import RAGAgent
-from rag.loaders import build_documents_from_data_dir
+from rag.agent import RAGAgent, ANN_MIN_CHUNKS
+from rag.loaders import build_documents_from_data_dir, iter_source_files
+from rag.onnx_embeddings import OnnxMiniLMEmbeddings
+
+try:
+    import torch
+except ImportError:  # optional; only used to cap encoder threads
+    torch = None
+
+
+def _encoder_threads() -> int:
+    # Intra-op threads for the embedding model (torch or ONNX Runtime)
+    return int(os.getenv("RAG_TORCH_THREADS", str(min(4, os.cpu_count() or 1))))
+
+
+def _embedding_dim(embeddings: Embeddings) -> int | None:
+    """Output size of the embedding model, read from its config rather than by encoding a probe."""
+    client = getattr(embeddings, "client", None)  # SentenceTransformerEmbeddings
+    if client is not None and hasattr(client, "get_sentence_embedding_dimension"):
+        return client.get_sentence_embedding_dimension()
+    session = getattr(embeddings, "session", None)  # OnnxMiniLMEmbeddings
+    if session is not None:
+        dim = session.get_outputs()[0].shape[-1]
+        if isinstance(dim, int):
+            return dim
+    # Last resort: encode a probe
+    return len(embeddings.embed_query("test"))
+
+
+def _merge_small_chunks(text: str, pieces: List[str], min_chars: int, max_chars: int) -> List[str]:
+    """Fold splitter fragments under min_chars into the preceding chunk when the covered span of
+    text stays within max_chars; spans are cut from the source text so overlaps aren't duplicated."""
+    out: List[str] = []
+    spans: List[int] = []  # start offset of each output chunk in text, -1 if not located
+    pos = 0
+    for piece in pieces:
+        start = text.find(piece, pos)
+        if start != -1:
+            pos = start + 1
+        if out and len(piece) < min_chars and start != -1 and spans[-1] != -1:
+            merged = text[spans[-1]:start + len(piece)].strip()
+            if len(merged) <= max_chars:
+                out[-1] = merged
+                continue
+        out.append(piece)
+        spans.append(start)
+    return out
+
+
+# Corpus size from which the index stores product-quantized codes instead of full float32 vectors
+IVFPQ_MIN_CHUNKS = int(os.getenv("RAG_IVFPQ_MIN_CHUNKS", "200000"))
+
+
+def _make_index(vectors: np.ndarray) -> faiss.Index:
+    """Empty inner-product index sized for the corpus; vectors are unit-norm, so inner product == cosine.
+    Exact flat scan for portfolio-sized corpora, an int8 HNSW graph (O(log N) search) past ANN_MIN_CHUNKS,
+    and IVF-PQ past IVFPQ_MIN_CHUNKS, where full vectors would dominate RAM."""
+    n, d = vectors.shape
+    if n < ANN_MIN_CHUNKS:
+        return faiss.IndexFlatIP(d)
+    if n < IVFPQ_MIN_CHUNKS:
+        # Graph over 8-bit scalar-quantized vectors: a quarter of the float32 bytes, near-identical ranking
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 100
+        index.hnsw.efSearch = 64
+        index.train(vectors)
+        return index
+    # ~4*sqrt(N) lists; 8 dims per 8-bit sub-quantizer (48 bytes per MiniLM vector vs 1536)
+    nlist = int(4 * np.sqrt(n))
+    m = next(m for m in range(max(1, d // 8), 0, -1) if d % m == 0)
+    index = faiss.IndexIVFPQ(faiss.IndexFlatIP(d), d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+    # A random sample of ~64 points per list trains as well as the full corpus
+    sample = vectors[np.random.default_rng(0).choice(n, size=min(n, 64 * nlist), replace=False)]
+    index.train(sample)
+    index.nprobe = 16
+    return index
 
 
 class RAGSystem:
@@ -19,14 +100,46 @@ class RAGSystem:
         self.agent: RAGAgent | None = None
         self.vector_store_path = Path(__file__).parent / "vector_store"
         self.embedding_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        self.chunk_size = 800
+        self.chunk_overlap = 150
+        # Fragments shorter than this are folded into the preceding chunk of the same document
+        self.min_chunk_chars = 100
+        # Parsed documents per data file, so a rebuild only re-parses changed files (RAG_DOCS_CACHE=0 disables)
+        self.docs_cache_path = Path(__file__).parent / ".docs_cache" / "docs.pkl"
+        # ONNX export of the same model; used instead of PyTorch when present
+        self.onnx_model_dir = Path(os.getenv("RAG_ONNX_MODEL_DIR", str(Path(__file__).parent / "onnx_minilm")))
+        # One encoder per process, shared by index builds, loads and the agent
+        self.embeddings: Embeddings | None = None
+
+    def _embeddings(self) -> Embeddings:
+        if self.embeddings is None:
+            self.embeddings = self._load_embeddings()
+        return self.embeddings
+
+    def _load_embeddings(self) -> Embeddings:
+        if OnnxMiniLMEmbeddings.available(self.onnx_model_dir):
+            try:
+                return OnnxMiniLMEmbeddings(self.onnx_model_dir, threads=_encoder_threads())
+            except Exception as e:
+                print(f"[RAG] ONNX encoder unavailable, using SentenceTransformer: {e}")
+        # Large explicit batches for the one-off chunk encode (sentence-transformers length-sorts
+        # within encode, so each batch pads to similar lengths); unit-norm vectors so cosine is a dot product
+        return SentenceTransformerEmbeddings(
+            model_name=self.embedding_model_name,
+            encode_kwargs={"batch_size": 128, "normalize_embeddings": True, "show_progress_bar": False},
+        )
 
     def _chunk_documents(self, docs: List[Document]) -> List[Document]:
         splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=150,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
             separators=["\n\n", "\n", " ", ""],
         )
-        chunks = splitter.split_documents(docs)
+        chunks: List[Document] = []
+        for doc in docs:
+            pieces = _merge_small_chunks(doc.page_content, splitter.split_text(doc.page_content),
+                                         self.min_chunk_chars, self.chunk_size + self.chunk_overlap)
+            chunks.extend(Document(page_content=p, metadata=dict(doc.metadata or {})) for p in pieces)
 
         # Prefix each chunk with a short source header so the model can ground answers
         prefixed: List[Document] = []
@@ -45,18 +158,82 @@ class RAGSystem:
             prefixed.append(Document(page_content=f"{header}{d.page_content}", metadata=meta))
         return prefixed
 
-    def _build_store(self, data_dir: Path) -> FAISS:
-        docs = build_documents_from_data_dir(data_dir)
+    def _fingerprint(self, data_dir: Path) -> str:
+        """Hash of the parsed data files plus the indexing settings; a changed value means the saved index is stale.
+        Only loader inputs count, so the SQLite files sharing data_dir never force a rebuild."""
+        h = hashlib.sha256(f"{self.embedding_model_name}|{self.chunk_size}|{self.chunk_overlap}|{self.min_chunk_chars}".encode())
+        for path in sorted(iter_source_files(data_dir)):
+            h.update(str(path.relative_to(data_dir)).encode("utf-8"))
+            h.update(path.read_bytes())
+        return h.hexdigest()
+
+    def _embed_chunks(self, embeddings: Embeddings, texts: List[str]) -> np.ndarray:
+        """Embed chunk texts, reusing vectors from the previous build for chunks whose text is unchanged,
+        so a rebuild after editing one file only encodes that file's chunks."""
+        cache_path = self.vector_store_path / "chunk_embeddings.npz"
+        # Keyed by encoder and text, so a different model or export never reuses stale vectors
+        tag = getattr(embeddings, "model_path", None) or getattr(embeddings, "model_name", None) or type(embeddings).__name__
+        keys = [hashlib.sha1(f"{tag}\0{t}".encode("utf-8")).hexdigest() for t in texts]
+
+        cached: Dict[str, np.ndarray] = {}
+        try:
+            with np.load(cache_path) as z:
+                cached = dict(zip(z["keys"].tolist(), z["vectors"]))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[RAG] Ignoring unreadable embedding cache: {e}")
+
+        missing = list(dict.fromkeys(k for k in keys if k not in cached))
+        if missing:
+            first = {k: i for i, k in reversed(list(enumerate(keys)))}
+            new = np.asarray(embeddings.embed_documents([texts[first[k]] for k in missing]), dtype=np.float32)
+            cached.update(zip(missing, new))
+        print(f"[RAG] Embedded {len(missing)} new/changed chunks, reused {len(texts) - len(missing)}")
+        vectors = np.stack([cached[k] for k in keys]).astype(np.float32)
+
+        # Keep only the current chunks so the cache tracks the corpus
+        try:
+            os.makedirs(self.vector_store_path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.vector_store_path, suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, keys=np.array(keys), vectors=vectors)
+            os.replace(tmp, cache_path)
+        except Exception as e:
+            print(f"[RAG] Could not save embedding cache: {e}")
+        return vectors
+
+    def _build_store(self, data_dir: Path, use_docs_cache: bool = True) -> FAISS:
+        use_docs_cache = use_docs_cache and os.getenv("RAG_DOCS_CACHE", "1") != "0"
+        docs = build_documents_from_data_dir(data_dir, self.docs_cache_path if use_docs_cache else None)
         if not docs:
             raise ValueError(f"No documents found in {data_dir}")
 
         chunks = self._chunk_documents(docs)
-        embeddings = SentenceTransformerEmbeddings(model_name=self.embedding_model_name)
-        store = FAISS.from_documents(chunks, embeddings)
+        embeddings = self._embeddings()
+        vectors = self._embed_chunks(embeddings, [c.page_content for c in chunks])
+        faiss.normalize_L2(vectors)
 
-        # Persist vector store
+        index = _make_index(vectors)
+        store = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
+        store.add_embeddings(
+            list(zip([c.page_content for c in chunks], vectors.tolist())),
+            metadatas=[c.metadata for c in chunks],
+        )
+
+        # Persist vector store with the fingerprint of the inputs it was built from
         os.makedirs(self.vector_store_path, exist_ok=True)
         store.save_local(str(self.vector_store_path))
+        try:
+            (self.vector_store_path / "fingerprint").write_text(self._fingerprint(data_dir))
+        except Exception as e:
+            print(f"[RAG] Could not record data fingerprint: {e}")
         return store
 
     def initialize(self, data_dir: str, force_rebuild: bool = False):
@@ -64,18 +241,44 @@ class RAGSystem:
         print("Initializing RAG system...")
         data_path = Path(data_dir)
 
+        # Cap intra-op threads so several server workers don't oversubscribe the CPU; single
+        # sentence-embedding graphs have no independent ops to run across inter-op threads
+        if torch is not None:
+            torch.set_num_threads(_encoder_threads())
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass  # only settable before torch's first parallel op
+
+        # An explicit rebuild (reindex) re-parses every file; automatic rebuilds reuse unchanged ones
+        reparse = force_rebuild
+
         def build_store():
             print(f"Indexing data directory: {data_path}")
-            return self._build_store(data_path)
+            return self._build_store(data_path, use_docs_cache=not reparse)
+
+        # Reuse the saved index only if it was built from the current data files
+        if self.vector_store_path.exists() and not force_rebuild:
+            try:
+                saved = (self.vector_store_path / "fingerprint").read_text().strip()
+            except OSError:
+                saved = None
+            try:
+                current = self._fingerprint(data_path)
+            except Exception as e:
+                print(f"[RAG] Could not fingerprint {data_path}: {e}")
+                current = saved
+            if saved is not None and saved != current:
+                print("Data directory changed since the vector store was built; rebuilding...")
+                force_rebuild = True
 
         # Load existing if present
         if self.vector_store_path.exists() and not force_rebuild:
             print("Loading existing vector store...")
             try:
-                embeddings = SentenceTransformerEmbeddings(model_name=self.embedding_model_name)
                 self.vector_store = FAISS.load_local(
                     str(self.vector_store_path),
-                    embeddings,
+                    self._embeddings(),
                     allow_dangerous_deserialization=True,
                 )
             except Exception as e:
@@ -84,32 +287,33 @@ class RAGSystem:
                 force_rebuild = True
 
         # Build if needed
-        if not self.vector_store or force_rebuild:
+        built = not self.vector_store or force_rebuild
+        if built:
             self.vector_store = build_store()
 
-        # Validate embedding dimension matches FAISS index dimension
-        try:
-            test_vec = self.vector_store.embedding_function.embed_query("test")
-            index_dim = getattr(self.vector_store.index, "d", None)
-            embed_dim = len(test_vec) if hasattr(test_vec, "__len__") else None
-            print(f"[RAG] FAISS index dim={index_dim}, embedding dim={embed_dim}")
-            if index_dim and embed_dim and index_dim != embed_dim:
-                print("[RAG] Dimension mismatch detected. Rebuilding vector store...")
-                self.vector_store = build_store()
-                test_vec = self.vector_store.embedding_function.embed_query("test")
+        # Validate embedding dimension matches FAISS index dimension; a freshly built index matches by construction
+        if not built:
+            try:
                 index_dim = getattr(self.vector_store.index, "d", None)
-                embed_dim = len(test_vec) if hasattr(test_vec, "__len__") else None
-                print(f"[RAG] After rebuild: FAISS index dim={index_dim}, embedding dim={embed_dim}")
-        except Exception as e:
-            print(f"[RAG] Warning: failed to validate vector store dimensions: {e}")
+                embed_dim = _embedding_dim(self.vector_store.embedding_function)
+                print(f"[RAG] FAISS index dim={index_dim}, embedding dim={embed_dim}")
+                if index_dim and embed_dim and index_dim != embed_dim:
+                    print("[RAG] Dimension mismatch detected. Rebuilding vector store...")
+                    self.vector_store = build_store()
+            except Exception as e:
+                print(f"[RAG] Warning: failed to validate vector store dimensions: {e}")
 
         # Initialize agent
         print("Initializing RAG agent...")
+        old_agent = self.agent
         self.agent = RAGAgent(
             self.vector_store,
             openrouter_api_key=self.openrouter_api_key,
             model_name=self.model_name,
         )
+        # Release the replaced agent (reindex) so its threads, matrix and caches can be freed
+        if old_agent is not None:
+            old_agent.close()
         print("RAG system ready!")
 
     def reindex(self, data_dir: str):
@@ -122,6 +326,19 @@ class RAGSystem:
             raise RuntimeError("RAG system not initialized. Call initialize() first.")
         return self.agent.chat(message, session_id)
 
+    async def achat(self, message: str, session_id: str) -> str:
+        """Send a message to the agent without blocking the event loop"""
+        if not self.agent:
+            raise RuntimeError("RAG system not initialized. Call initialize() first.")
+        return await self.agent.achat(message, session_id)
+
+    async def achat_stream(self, message: str, session_id: str):
+        """Send a message to the agent; yields ("delta", text) events then ("final", reply)"""
+        if not self.agent:
+            raise RuntimeError("RAG system not initialized. Call initialize() first.")
+        async for event in self.agent.achat_stream(message, session_id):
+            yield event
+
     def get_history(self, session_id: str):
         """Get chat history"""
         if not self.agent:
@@ -1,15 +1,33 @@
 from __future__ import annotations
 
 import json
+import multiprocessing
+import os
+import pickle
 import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import yaml
 from pypdf import PdfReader
 from langchain_core.documents import Document
 
+try:
+    import orjson
+except ImportError:  # optional; stdlib json parses JSON facts
+    orjson = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # optional; pypdf extracts PDF text instead
+    pdfium = None
+
+# libyaml's C parser when PyYAML was built with it; same safe semantics as yaml.safe_load
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 @dataclass
 class LoadedDoc:
@@ -18,23 +36,64 @@ class LoadedDoc:
 
 
 def _read_text(path: Path) -> str:
+    # One read and decode; undecodable bytes are dropped, newlines normalized as text mode would
+    text = path.read_bytes().decode("utf-8", errors="ignore")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# Pages in one PDF before extraction is split across processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", "8"))
+
+
+def _extract_pages(args: Tuple[str, int, int]) -> List[str]:
+    # Top-level so worker processes can run it; each worker opens its own reader
+    path, start, stop = args
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _pdfium_text(path: Path) -> List[str]:
+    # PDFium's native extractor; several times faster than pypdf's pure-Python one
+    pdf = pdfium.PdfDocument(str(path))
     try:
-        return path.read_text(encoding="utf-8", errors="ignore")
-    except Exception:
-        # Fallback without encoding if needed
-        return path.read_text(errors="ignore")
+        parts: List[str] = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return parts
+    finally:
+        pdf.close()
 
 
 def load_pdf_text(path: Path) -> str:
-    text = ""
+    if pdfium is not None:
+        try:
+            return "\n".join(_pdfium_text(path)).strip()
+        except Exception as e:
+            print(f"[loaders] PDFium could not read {path}, using pypdf: {e}")
+    parts: List[str] = []
     try:
         reader = PdfReader(str(path))
-        for page in reader.pages:
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
+        n = len(reader.pages)
+        workers = min(os.cpu_count() or 1, n // 4)
+        # Text extraction is CPU-bound pure Python; long PDFs get one contiguous page range per process.
+        # Skipped inside a worker (build_documents_from_data_dir already parses files in parallel)
+        if n >= PDF_PARALLEL_MIN_PAGES and workers > 1 and multiprocessing.parent_process() is None:
+            bounds = [n * w // workers for w in range(workers + 1)]
+            ranges = [(str(path), bounds[w], bounds[w + 1]) for w in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                for texts in ex.map(_extract_pages, ranges):
+                    parts.extend(texts)
+        else:
+            for page in reader.pages:
+                parts.append(page.extract_text() or "")
     except Exception as e:
         print(f"[loaders] PDF read error for {path}: {e}")
-    return text.strip()
+    return "\n".join(parts).strip()
 
 
 def load_md_text(path: Path) -> Tuple[Dict[str, Any], str]:
@@ -54,7 +113,7 @@ def load_md_text(path: Path) -> Tuple[Dict[str, Any], str]:
             fm_block = parts[:idx]
             rest = parts[idx + len("\n---") + 1 :]
             try:
-                fm = yaml.safe_load(fm_block) or {}
+                fm = yaml.load(fm_block, Loader=_YAML_LOADER) or {}
                 if not isinstance(fm, dict):
                     fm = {}
                 content = rest
@@ -74,19 +133,17 @@ def _flatten_yaml_to_facts(data: Any, prefix: str = "") -> List[str]:
       "Education: level=PU; institution=ABC"
     """
     facts: List[str] = []
-
-    if isinstance(data, dict):
-        for k, v in data.items():
-            key = f"{prefix}{k}" if not prefix else f"{prefix}.{k}"
-            facts.extend(_flatten_yaml_to_facts(v, key))
-    elif isinstance(data, list):
-        for idx, v in enumerate(data):
-            key = f"{prefix}[{idx}]"
-            facts.extend(_flatten_yaml_to_facts(v, key))
-    else:
-        # Primitive
-        p = prefix.replace(".", ": ")
-        facts.append(f"{p}: {data}")
+    # Iterative pre-order walk; children are pushed in reverse so facts keep document order
+    stack: List[Tuple[Any, str]] = [(data, prefix)]
+    while stack:
+        node, key = stack.pop()
+        if isinstance(node, dict):
+            stack.extend((v, f"{key}.{k}" if key else f"{k}") for k, v in reversed(list(node.items())))
+        elif isinstance(node, list):
+            stack.extend((v, f"{key}[{idx}]") for idx, v in reversed(list(enumerate(node))))
+        else:
+            # Primitive
+            facts.append(f"{key.replace('.', ': ')}: {node}")
 
     return facts
 
@@ -97,7 +154,7 @@ def load_yaml_facts(path: Path, default_type: str = "profile") -> List[LoadedDoc
     Otherwise, flatten to key-value statements.
     """
     try:
-        data = yaml.safe_load(_read_text(path))
+        data = yaml.load(_read_text(path), Loader=_YAML_LOADER)
     except Exception as e:
         print(f"[loaders] YAML parse error for {path}: {e}")
         return []
@@ -105,9 +162,7 @@ def load_yaml_facts(path: Path, default_type: str = "profile") -> List[LoadedDoc
     meta_base = {"source": str(path), "type": default_type, "filename": path.name}
 
     # Detect QnA shape
-    if isinstance(data, list) and all(isinstance(x, dict) for x in data) and all(
-        ("q" in x and "a" in x) for x in data
-    ):
+    if isinstance(data, list) and all(isinstance(x, dict) and "q" in x and "a" in x for x in data):
         out: List[LoadedDoc] = []
         for i, qa in enumerate(data):
             q = str(qa.get("q", "")).strip()
@@ -130,9 +185,19 @@ def load_yaml_facts(path: Path, default_type: str = "profile") -> List[LoadedDoc
     return [LoadedDoc(text=c, metadata=meta_base.copy()) for c in chunks if c.strip()]
 
 
+def _parse_json_file(path: Path) -> Any:
+    if orjson is not None:
+        try:
+            # Parses the raw bytes directly, no str decode
+            return orjson.loads(path.read_bytes())
+        except orjson.JSONDecodeError:
+            pass  # invalid UTF-8, NaN, huge ints: the lenient stdlib path below accepts these
+    return json.loads(_read_text(path))
+
+
 def load_json_facts(path: Path, default_type: str = "profile") -> List[LoadedDoc]:
     try:
-        data = json.loads(_read_text(path))
+        data = _parse_json_file(path)
     except Exception as e:
         print(f"[loaders] JSON parse error for {path}: {e}")
         return []
@@ -167,7 +232,103 @@ def to_documents(items: Iterable[LoadedDoc]) -> List[Document]:
     return [Document(page_content=i.text, metadata=i.metadata) for i in items if i.text.strip()]
 
 
-def build_documents_from_data_dir(data_dir: Path) -> List[Document]:
+def _load_pdf_docs(path: Path) -> List[Document]:
+    text = load_pdf_text(path)
+    if not text:
+        return []
+    doc_type = "resume" if path.stem.lower() == "resume" else "pdf"
+    return [Document(page_content=text, metadata={"source": str(path), "type": doc_type, "filename": path.name})]
+
+
+# YAML type inferred from the filename: first keyword contained in the stem, else "profile"
+_YAML_TYPE_KEYWORDS = ("qna", "timeline", "profile", "links")
+
+
+def _load_yaml_docs(path: Path) -> List[Document]:
+    name = path.stem.lower()
+    type_hint = next((k for k in _YAML_TYPE_KEYWORDS if k in name), "profile")
+    return to_documents(load_yaml_facts(path, default_type=type_hint))
+
+
+# Loader per recognized suffix; other types are ignored for now
+_LOADERS = {
+    ".pdf": _load_pdf_docs,
+    ".yaml": _load_yaml_docs,
+    ".yml": _load_yaml_docs,
+    ".json": lambda path: to_documents(load_json_facts(path, default_type="profile")),
+    ".md": lambda path: to_documents([load_md(path, default_type="notes")])[:1],
+    ".txt": lambda path: to_documents([load_txt(path, default_type="notes")])[:1],
+}
+
+
+def _load_path(path: Path) -> List[Document]:
+    """Documents for one data file; empty for unrecognized types."""
+    loader = _LOADERS.get(path.suffix.lower())
+    return loader(path) if loader else []
+
+
+def iter_data_files(data_dir: Path) -> Iterator[Path]:
+    """Files under data_dir in rglob order (each directory's files, then its subdirectories),
+    typed from scandir's cached d_type rather than a stat per entry; symlinked dirs are not followed."""
+    with os.scandir(data_dir) as it:
+        entries = list(it)
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+        elif entry.is_file():
+            yield Path(entry.path)
+    for sub in subdirs:
+        yield from iter_data_files(Path(sub))
+
+
+def iter_source_files(data_dir: Path) -> Iterator[Path]:
+    """The data files a loader parses (by suffix), in iter_data_files order. Anything else under
+    data_dir, such as the app's SQLite files (app.db, its -wal/-shm, analytics.db), is skipped."""
+    return (path for path in iter_data_files(data_dir) if path.suffix.lower() in _LOADERS)
+
+
+def _load_path_logged(path: Path) -> Optional[List[Document]]:
+    # Top-level so worker processes can run it; None marks a file that failed to parse
+    try:
+        return _load_path(path)
+    except Exception as e:
+        print(f"[loaders] Skipped {path} due to error: {e}")
+        return None
+
+
+# Data files parsed at once before parsing moves to a process pool (spawn/fork cost dominates below this)
+PARALLEL_MIN_FILES = int(os.getenv("RAG_PARALLEL_MIN_FILES", "8"))
+
+# Bump when parsing output changes so stale cache entries are discarded; the PDF extractor is part of it
+_DOCS_CACHE_VERSION = f"2:{'pdfium' if pdfium is not None else 'pypdf'}"
+
+
+def _load_docs_cache(path: Path) -> Dict[str, Tuple[int, int, List[Document]]]:
+    try:
+        with open(path, "rb") as f:
+            version, entries = pickle.load(f)
+        return entries if version == _DOCS_CACHE_VERSION else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[loaders] Ignoring unreadable document cache {path}: {e}")
+        return {}
+
+
+def _save_docs_cache(path: Path, entries: Dict[str, Tuple[int, int, List[Document]]]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((_DOCS_CACHE_VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[loaders] Could not write document cache {path}: {e}")
+
+
+def build_documents_from_data_dir(data_dir: Path, cache_path: Optional[Path] = None) -> List[Document]:
     """
     Walk the data directory and build Documents with metadata.
     Recognized files:
@@ -176,55 +337,53 @@ def build_documents_from_data_dir(data_dir: Path) -> List[Document]:
       - *.json (profile-like structured facts)
       - *.md (notes/projects with optional frontmatter)
       - *.txt (notes)
+    With cache_path, parsed documents are kept per file keyed by (mtime, size), so only
+    new or changed files are parsed again.
     """
     data_dir = Path(data_dir)
     if not data_dir.exists():
         return []
 
-    docs: List[Document] = []
-
-    for path in data_dir.rglob("*"):
-        if path.is_dir():
+    cached = _load_docs_cache(cache_path) if cache_path else {}
+    # Cached files are reused as-is; the rest are parsed below
+    stats: Dict[Path, Tuple[int, int]] = {}
+    parsed: Dict[Path, List[Document]] = {}
+    misses: List[Path] = []
+    for path in iter_source_files(data_dir):
+        try:
+            st = path.stat()
+        except OSError as e:
+            print(f"[loaders] Skipped {path} due to error: {e}")
             continue
-
-        suffix = path.suffix.lower()
-        name = path.stem.lower()
-
+        stats[path] = (st.st_mtime_ns, st.st_size)
+        hit = cached.get(str(path))
+        if hit is not None and hit[:2] == stats[path]:
+            parsed[path] = hit[2]
+        else:
+            misses.append(path)
+
+    # Parsing (pypdf especially) is CPU-bound pure Python; spread larger batches over processes
+    if len(misses) >= PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
         try:
-            if suffix == ".pdf":
-                text = load_pdf_text(path)
-                if text:
-                    docs.append(
-                        Document(
-                            page_content=text,
-                            metadata={"source": str(path), "type": "resume" if name == "resume" else "pdf", "filename": path.name},
-                        )
-                    )
-            elif suffix in (".yaml", ".yml"):
-                type_hint = (
-                    "qna"
-                    if "qna" in name
-                    else "timeline"
-                    if "timeline" in name
-                    else "profile"
-                    if "profile" in name
-                    else "links"
-                    if "links" in name
-                    else "profile"
-                )
-                items = load_yaml_facts(path, default_type=type_hint)
-                docs.extend(to_documents(items))
-            elif suffix == ".json":
-                items = load_json_facts(path, default_type="profile")
-                docs.extend(to_documents(items))
-            elif suffix == ".md":
-                docs.append(to_documents([load_md(path, default_type="notes")])[0])
-            elif suffix == ".txt":
-                docs.append(to_documents([load_txt(path, default_type="notes")])[0])
-            else:
-                # Ignore other types for now
-                pass
+            with ProcessPoolExecutor(max_workers=min(len(misses), os.cpu_count() or 1)) as ex:
+                results = list(ex.map(_load_path_logged, misses, chunksize=4))
         except Exception as e:
-            print(f"[loaders] Skipped {path} due to error: {e}")
+            print(f"[loaders] Parallel parse failed, parsing in-process: {e}")
+            results = [_load_path_logged(p) for p in misses]
+    else:
+        results = [_load_path_logged(p) for p in misses]
+    for path, file_docs in zip(misses, results):
+        if file_docs is not None:
+            parsed[path] = file_docs
 
+    entries: Dict[str, Tuple[int, int, List[Document]]] = {}
+    docs: List[Document] = []
+    for path, (mtime_ns, size) in stats.items():
+        if path in parsed:
+            entries[str(path)] = (mtime_ns, size, parsed[path])
+            docs.extend(parsed[path])
+    dirty = bool(misses)
+
+    if cache_path and (dirty or len(entries) != len(cached)):
+        _save_docs_cache(cache_path, entries)
     return docs
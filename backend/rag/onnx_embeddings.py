@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+except ImportError:  # optional; RAGSystem falls back to SentenceTransformerEmbeddings
+    ort = None
+    AutoTokenizer = None
+
+try:
+    import numba
+except ImportError:  # optional; NumPy pooling below
+    numba = None
+
+
+def _pool_norm_np(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Masked mean over tokens, then L2-normalize: (B, L, D), (B, L) -> (B, D)."""
+    m = mask[..., None].astype(np.float32)
+    pooled = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+    return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+
+if numba is not None:
+    @numba.njit(fastmath=True, cache=True)
+    def _pool_norm(hidden, mask):
+        # Fused single pass per sentence: no (B, L, D) temporary for the masked product
+        b, l, d = hidden.shape
+        out = np.zeros((b, d), dtype=np.float32)
+        for i in range(b):
+            count = 0.0
+            for t in range(l):
+                if mask[i, t]:
+                    count += 1.0
+                    for k in range(d):
+                        out[i, k] += hidden[i, t, k]
+            sq = 0.0
+            for k in range(d):
+                out[i, k] /= max(count, 1e-9)
+                sq += out[i, k] * out[i, k]
+            norm = max(np.sqrt(sq), 1e-12)
+            for k in range(d):
+                out[i, k] /= norm
+        return out
+else:
+    _pool_norm = _pool_norm_np
+
+
+# Preferred model files in an export directory: int8-quantized, then graph-optimized, then plain
+MODEL_FILES = ("model_int8.onnx", "model_optimized.onnx", "model.onnx")
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """MiniLM sentence embeddings via an ONNX export (mean pooling + L2 norm, matching
+    sentence-transformers/all-MiniLM-L6-v2 so existing FAISS indexes stay valid).
+
+    One-time export:
+        optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 --task feature-extraction --optimize O3 <dir>
+        python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \\
+            quantize_dynamic('<dir>/model_optimized.onnx', '<dir>/model_int8.onnx', weight_type=QuantType.QInt8)"
+    """
+
+    def __init__(self, model_dir: str | Path, model_file: Optional[str] = None, batch_size: int = 128, max_length: int = 256,
+                 threads: Optional[int] = None):
+        if ort is None:
+            raise ImportError("onnxruntime and transformers are required for ONNX embeddings")
+        model_dir = Path(model_dir)
+        model_file = model_file or self.find_model(model_dir)
+        if not model_file:
+            raise FileNotFoundError(f"No ONNX model in {model_dir}")
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.model_path = str(model_dir / model_file)
+        self.session = ort.InferenceSession(self.model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    @staticmethod
+    def find_model(model_dir: str | Path) -> Optional[str]:
+        return next((f for f in MODEL_FILES if (Path(model_dir) / f).exists()), None)
+
+    @staticmethod
+    def available(model_dir: str | Path) -> bool:
+        return ort is not None and OnnxMiniLMEmbeddings.find_model(model_dir) is not None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        return _pool_norm(np.ascontiguousarray(hidden, dtype=np.float32), np.ascontiguousarray(enc["attention_mask"]))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Encode in length order so each batch pads to similar lengths, then restore input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        out: List[List[float]] = [[] for _ in texts]
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            for i, vec in zip(idx, self._encode([texts[i] for i in idx]).tolist()):
+                out[i] = vec
+        return out
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
@@ -1,42 +1,94 @@
 from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from transformers import AutoTokenizer
 from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_community.vectorstores import FAISS
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
+
+
+@lru_cache(maxsize=4)
+def _get_embeddings(model_name: str, batch_size: int = 64) -> SentenceTransformerEmbeddings:
+    """One loaded model per (name, batch size), shared by every processor and loaded store."""
+    return SentenceTransformerEmbeddings(
+        model_name=model_name,
+        encode_kwargs={"batch_size": batch_size, "show_progress_bar": False},
+    )
+
+
+def _strip_overlap(prev: str, chunk: str) -> str:
+    """chunk without the leading text the splitter repeated from the end of prev (its overlap).
+    Only whole-word overlaps count, so a coincidental one-letter match is kept."""
+    for k in range(min(len(prev), len(chunk)), 0, -1):
+        if (prev.endswith(chunk[:k]) and (k == len(chunk) or chunk[k].isspace())
+                and (k == len(prev) or prev[-k - 1].isspace())):
+            return chunk[k:].lstrip()
+    return chunk
+
 
 class ResumeProcessor:
-    def __init__(self, pdf_path: str, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    _tokenizer = None  # shared across instances; loaded on first chunk_text
+
+    def __init__(self, pdf_path: str, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 64):
         self.pdf_path = pdf_path
+        self.batch_size = batch_size
         # Use local sentence-transformers via LangChain community (no API key required)
-        self.embeddings = SentenceTransformerEmbeddings(model_name=embedding_model)
+        self.embeddings = _get_embeddings(embedding_model, batch_size)
         self.vector_store = None
         
     def extract_text_from_pdf(self) -> str:
         """Extract text from PDF file"""
         try:
             reader = PdfReader(self.pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-            return text
+            return "".join([page.extract_text() for page in reader.pages])
         except Exception as e:
             print(f"Error extracting text from PDF: {e}")
             return ""
     
-    def chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks for embedding"""
+    @classmethod
+    def _token_len(cls, text: str) -> int:
+        if cls._tokenizer is None:
+            cls._tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+        return len(cls._tokenizer.encode(text, add_special_tokens=False))
+
+    def chunk_text(self, text: str, chunk_tokens: int = 200, overlap_tokens: int = 20, min_tokens: int = 100) -> List[str]:
+        """Split text into chunks measured in model tokens, so none is truncated by the
+        encoder's 256-token window; fragments under min_tokens are merged into a neighbour"""
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+            chunk_size=chunk_tokens,
+            chunk_overlap=overlap_tokens,
+            length_function=self._token_len,
             separators=["\n\n", "\n", " ", ""]
         )
-        chunks = text_splitter.split_text(text)
+        chunks: List[str] = []
+        sizes: List[int] = []
+        prev = ""
+        for chunk in text_splitter.split_text(text):
+            n = self._token_len(chunk)
+            if chunks and (n < min_tokens or sizes[-1] < min_tokens) and sizes[-1] + n <= chunk_tokens:
+                # The previous chunk already holds the overlap; append only the new text
+                tail = _strip_overlap(prev, chunk)
+                if tail:
+                    chunks[-1] = f"{chunks[-1]}\n{tail}"
+                    sizes[-1] += self._token_len(tail)
+            else:
+                chunks.append(chunk)
+                sizes.append(n)
+            prev = chunk
         return chunks
     
-    def create_vector_store(self, chunks: List[str]) -> FAISS:
-        """Create FAISS vector store from text chunks"""
-        self.vector_store = FAISS.from_texts(chunks, self.embeddings)
+    def create_vector_store(self, chunks: List[str], checkpoint_path: Optional[str] = None) -> FAISS:
+        """Create FAISS vector store from text chunks, embedding batch_size chunks at a time
+        (optionally saving to checkpoint_path every 10 batches)"""
+        batches = [chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)]
+        if not batches:
+            raise ValueError("No chunks to index")
+        vector_store = FAISS.from_texts(batches[0], self.embeddings)
+        for i, batch in enumerate(batches[1:], start=2):
+            vector_store.add_texts(batch)
+            if checkpoint_path and i % 10 == 0:
+                vector_store.save_local(checkpoint_path)
+        self.vector_store = vector_store
         return self.vector_store
     
     def process_resume(self) -> FAISS:
@@ -67,7 +119,6 @@ class ResumeProcessor:
     @classmethod
     def load_vector_store(cls, load_path: str, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2") -> FAISS:
         """Load vector store from disk"""
-        embeddings = SentenceTransformerEmbeddings(model_name=embedding_model)
-        vector_store = FAISS.load_local(load_path, embeddings, allow_dangerous_deserialization=True)
+        vector_store = FAISS.load_local(load_path, _get_embeddings(embedding_model), allow_dangerous_deserialization=True)
         print(f"Vector store loaded from {load_path}")
         return vector_store
\ No newline at end of file
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain.schema import HumanMessage, AIMessage
+
+try:
+    import redis
+except ImportError:  # optional; sessions stay in process memory
+    redis = None
+
+try:
+    import msgpack
+except ImportError:  # optional; Redis entries are JSON instead
+    msgpack = None
+
+
+def _pack(msg: Any) -> bytes:
+    row = {"r": "u" if isinstance(msg, HumanMessage) else "a", "c": msg.content}
+    if msgpack is not None:
+        return msgpack.packb(row)
+    return json.dumps(row).encode("utf-8")
+
+
+def _unpack(raw: bytes) -> Any:
+    # JSON entries always start with "{"; msgpack maps never do
+    row = json.loads(raw) if raw[:1] == b"{" else msgpack.unpackb(raw)
+    return HumanMessage(content=row["c"]) if row["r"] == "u" else AIMessage(content=row["c"])
+
+
+class MemorySessionStore:
+    """Per-process recent messages, one bounded deque per session, least recently used
+    sessions evicted past max_sessions or after ttl idle seconds. Safe to use from concurrent request threads."""
+
+    def __init__(self, maxlen: int, max_sessions: int = 1000, ttl: float = 3600):
+        self.maxlen = maxlen
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        # Last access per session, in the same (least recent first) order as _sessions
+        self._touched: Dict[str, float] = {}
+        # Guards the dict and deque mutations; every critical section is O(1) amortized
+        self._lock = threading.Lock()
+
+    def _evict(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if len(self._sessions) <= self.max_sessions and self._touched[oldest] >= cutoff:
+                break
+            del self._sessions[oldest]
+            del self._touched[oldest]
+
+    def _touch(self, session_id: str) -> None:
+        self._sessions.move_to_end(session_id)
+        self._touched[session_id] = time.monotonic()
+
+    def _put(self, session_id: str, d: deque) -> None:
+        self._sessions[session_id] = d
+        self._touch(session_id)
+        self._evict()
+
+    def recent(self, session_id: str) -> Optional[List[Any]]:
+        # A snapshot taken under the lock; concurrent turns only change the store through append
+        with self._lock:
+            self._evict()
+            d = self._sessions.get(session_id)
+            if d is None:
+                return None
+            self._touch(session_id)
+            return list(d)
+
+    def replace(self, session_id: str, msgs: Iterable[Any]) -> None:
+        d = deque(msgs, maxlen=self.maxlen)
+        with self._lock:
+            self._put(session_id, d)
+
+    def append(self, session_id: str, msg: Any) -> None:
+        with self._lock:
+            d = self._sessions.get(session_id)
+            if d is None:
+                d = deque(maxlen=self.maxlen)
+                self._put(session_id, d)
+            else:
+                self._touch(session_id)
+            d.append(msg)
+
+
+class RedisSessionStore:
+    """Recent messages in a capped Redis list per session, shared by all workers and expiring after ttl seconds."""
+
+    def __init__(self, url: str, maxlen: int, ttl: int = 3600, prefix: str = "rag:session:"):
+        self.client = redis.Redis.from_url(url)
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def recent(self, session_id: str) -> Optional[List[Any]]:
+        rows = self.client.lrange(self.prefix + session_id, -self.maxlen, -1)
+        # Redis removes empty lists, so no rows means unknown (or expired) session
+        if not rows:
+            return None
+        return [_unpack(r) for r in rows]
+
+    def replace(self, session_id: str, msgs: Iterable[Any]) -> None:
+        key = self.prefix + session_id
+        packed = [_pack(m) for m in msgs][-self.maxlen:]
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key)
+        if packed:
+            pipe.rpush(key, *packed)
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def append(self, session_id: str, msg: Any) -> None:
+        key = self.prefix + session_id
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(key, _pack(msg))
+        pipe.ltrim(key, -self.maxlen, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+def make_session_store(maxlen: int):
+    """Redis-backed when REDIS_URL is set and redis is installed, else in-process."""
+    url = os.getenv("REDIS_URL")
+    ttl = int(os.getenv("RAG_SESSION_TTL_S", "3600"))
+    if url and redis is not None:
+        try:
+            store = RedisSessionStore(url, maxlen, ttl=ttl)
+            store.client.ping()
+            return store
+        except Exception as e:
+            print(f"[RAG] Redis session store unavailable, using process memory: {e}")
+    return MemorySessionStore(maxlen, ttl=ttl)
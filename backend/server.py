@@ -1,20 +1,32 @@
 from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.requests import Request
 import os
+import asyncio
+import functools
 import logging
 import requests
+import anyio.to_thread
 import json
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
 from models.chat import ChatRequest, ChatResponse
 from rag.init_rag import RAGSystem
-from db import init_db, upsert_session, insert_message, fetch_analytics, fetch_analytics_sessions
+from db import init_db, queue_session, queue_session_geo, queue_message, fetch_analytics, fetch_analytics_sessions
 from ipaddress import ip_address
 
+try:
+    import orjson
+except ImportError:  # optional; responses use stdlib json
+    orjson = None
+
 
 # Configure logging first
 logging.basicConfig(
@@ -29,11 +41,32 @@ load_dotenv(ROOT_DIR / '.env')
 # Initialize RAG System
 rag_system = None
 openrouter_key = os.environ.get('OPENROUTER_API_KEY')
-
-# Simple in-memory cache for IP -> geo lookups
-_GEO_CACHE: dict[str, dict] = {}
-
-
+# Read once: used for every logged assistant message
+MODEL_NAME = os.environ.get('OPENROUTER_MODEL', 'openai/gpt-oss-20b:free')
+
+# Keep-alive sessions for the OpenRouter debug endpoint and the GeoIP providers; closed on shutdown
+_debug_http = requests.Session()
+_geo_http = requests.Session()
+
+# Server-side IP geolocation provider: ipapi (default) or ipinfo (optional token)
+GEOIP_PROVIDER = os.environ.get('GEOIP_PROVIDER', 'ipapi').lower()
+GEOIP_TOKEN = os.environ.get('GEOIP_TOKEN')
+
+# Bounded LRU of IP -> (expires_at, geo); failed lookups are cached as None for a shorter time
+# so repeat visitors do not re-hit a provider that rate-limited or could not place them.
+# Only touched from the event loop thread.
+GEO_CACHE_MAX = int(os.environ.get('GEO_CACHE_MAX', '10000'))
+GEO_CACHE_TTL_S = float(os.environ.get('GEO_CACHE_TTL_S', '86400'))
+GEO_NEG_TTL_S = float(os.environ.get('GEO_NEG_TTL_S', '3600'))
+_GEO_CACHE: "OrderedDict[str, tuple[float, dict | None]]" = OrderedDict()
+# Lookups currently in flight, so a burst from one new visitor makes a single provider call
+_GEO_INFLIGHT: dict[str, asyncio.Future] = {}
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+_background_tasks: set[asyncio.Task] = set()
+
+
+# Visitors repeat across requests, so both IP checks are memoized per address string
+@functools.lru_cache(maxsize=4096)
 def _is_private_ip(ip: str) -> bool:
     try:
         addr = ip_address(ip)
@@ -46,57 +79,86 @@ def _is_private_ip(ip: str) -> bool:
         return True
 
 
-def _parse_xff(xff: str) -> list[str]:
-    parts = [p.strip() for p in (xff or "").split(",")]
-    ips: list[str] = []
-    for p in parts:
-        try:
-            ip_address(p)
-            ips.append(p)
-        except Exception:
+# Single-IP headers set by CDNs/proxies, checked in priority order before X-Forwarded-For
+_PROXY_IP_HEADERS = ("cf-connecting-ip", "true-client-ip", "x-real-ip", "fly-client-ip")
+
+
+@functools.lru_cache(maxsize=4096)
+def _validate_ip(ip: str) -> bool:
+    try:
+        ip_address(ip)
+        return True
+    except ValueError:
+        return False
+
+
+def _first_public_xff(xff: str) -> str | None:
+    """First public IP in an X-Forwarded-For chain, else its first valid IP, in a single pass."""
+    fallback = None
+    for part in xff.split(","):
+        ip = part.strip()
+        if not _validate_ip(ip):
             continue
-    return ips
+        if not _is_private_ip(ip):
+            return ip
+        if fallback is None:
+            fallback = ip
+    return fallback
 
 def _extract_client_ip(req: Request) -> str | None:
     """Extract the most likely real client IP from common proxy/CDN headers.
     Priority order: CF-Connecting-IP, True-Client-IP, X-Real-IP, Fly-Client-IP, first public in X-Forwarded-For, fallback to req.client.host
     """
     h = req.headers
-    for key in ["cf-connecting-ip", "true-client-ip", "x-real-ip", "fly-client-ip"]:
+    for key in _PROXY_IP_HEADERS:
         val = h.get(key)
         if val:
             return val
-    # X-Forwarded-For may contain multiple IPs. Take the first public one.
+    # X-Forwarded-For may contain multiple IPs. Take the first public one, else the first valid one.
     xff = h.get("x-forwarded-for")
     if xff:
-        for ip in _parse_xff(xff):
-            try:
-                if not _is_private_ip(ip):
-                    return ip
-            except Exception:
-                continue
-        # if none public, fall back to first
-        ips = _parse_xff(xff)
-        if ips:
-            return ips[0]
+        ip = _first_public_xff(xff)
+        if ip:
+            return ip
     return req.client.host if req.client else None
 
-def _geo_from_ip(ip: str) -> dict | None:
+async def _geo_from_ip(ip: str) -> dict | None:
     """Best-effort geolocation for an IP using ipapi.co by default, ipinfo (token), and ipwho.is as fallback.
     Returns dict with keys: country, region, city, lat, lon, timezone, asn, org, isp (where available).
+    Cache misses run the provider calls in a worker thread so the event loop keeps serving; concurrent
+    misses for the same IP share one lookup.
     """
     if not ip or _is_private_ip(ip):
         return None
-    if ip in _GEO_CACHE:
-        return _GEO_CACHE[ip]
-
-    provider = os.environ.get('GEOIP_PROVIDER', 'ipapi').lower()
+    now = time.monotonic()
+    hit = _GEO_CACHE.get(ip)
+    if hit is not None and hit[0] > now:
+        _GEO_CACHE.move_to_end(ip)
+        return hit[1]
+    fut = _GEO_INFLIGHT.get(ip)
+    if fut is None:
+        fut = asyncio.ensure_future(_fetch_geo(ip))
+        _GEO_INFLIGHT[ip] = fut
+        fut.add_done_callback(lambda _: _GEO_INFLIGHT.pop(ip, None))
+    # Shielded so one cancelled waiter does not cancel the lookup for the others
+    return await asyncio.shield(fut)
+
+
+async def _fetch_geo(ip: str) -> dict | None:
+    res = await asyncio.to_thread(_lookup_geo, ip)
+    _GEO_CACHE[ip] = (time.monotonic() + (GEO_CACHE_TTL_S if res else GEO_NEG_TTL_S), res)
+    _GEO_CACHE.move_to_end(ip)
+    while len(_GEO_CACHE) > GEO_CACHE_MAX:
+        _GEO_CACHE.popitem(last=False)
+    return res
+
+
+def _lookup_geo(ip: str) -> dict | None:
     try:
-        if provider == 'ipinfo':
-            token = os.environ.get('GEOIP_TOKEN')
+        if GEOIP_PROVIDER == 'ipinfo':
             url = f"https://ipinfo.io/{ip}/json"
-            params = {"token": token} if token else {}
-            r = requests.get(url, params=params, timeout=5)
+            params = {"token": GEOIP_TOKEN} if GEOIP_TOKEN else {}
+            r = _geo_http.get(url, params=params, timeout=5)
             if r.status_code == 200:
                 d = r.json() or {}
                 loc = d.get('loc') or ''
@@ -112,11 +174,10 @@ def _geo_from_ip(ip: str) -> dict | None:
                     'org': d.get('org'),
                     'isp': d.get('org'),
                 }
-                _GEO_CACHE[ip] = res
                 return res
         # default: ipapi.co (no token required, free tier limits)
         url = f"https://ipapi.co/{ip}/json/"
-        r = requests.get(url, timeout=5)
+        r = _geo_http.get(url, timeout=5)
         if r.status_code == 200:
             d = r.json() or {}
             res = {
@@ -136,11 +197,10 @@ def _geo_from_ip(ip: str) -> dict | None:
                 res['lon'] = float(res['lon']) if res['lon'] is not None else None
             except Exception:
                 pass
-            _GEO_CACHE[ip] = res
             return res
         # Fallback: ipwho.is
         url = f"https://ipwho.is/{ip}"
-        r = requests.get(url, timeout=5)
+        r = _geo_http.get(url, timeout=5)
         if r.status_code == 200:
             d = r.json() or {}
             if d.get('success') is True:
@@ -161,7 +221,6 @@ def _geo_from_ip(ip: str) -> dict | None:
                     res['lon'] = float(res['lon']) if res['lon'] is not None else None
                 except Exception:
                     pass
-                _GEO_CACHE[ip] = res
                 return res
             else:
                 logger.warning(f"ipwho.is lookup unsuccessful for {ip}: {d}")
@@ -173,29 +232,100 @@ try:
     # Initialize DB first
     db_path = init_db()
     logging.info(f"App DB initialized at: {db_path}")
-    # Override model via env if desired
-    model_name = os.environ.get('OPENROUTER_MODEL', 'openai/gpt-oss-20b:free')
-    rag_system = RAGSystem(openrouter_api_key=openrouter_key, model_name=model_name)
-    data_dir = ROOT_DIR / 'data'
-    rag_system.initialize(str(data_dir))
-    logging.info(f"RAG system initialized successfully with model: {model_name}")
+    # Override model via env if desired (OPENROUTER_MODEL)
+    rag_system = RAGSystem(openrouter_api_key=openrouter_key, model_name=MODEL_NAME)
 except Exception as e:
     logging.error(f"Failed to initialize systems: {e}")
     rag_system = None
 
+# Set once background RAG initialization has finished, successfully or not
+_rag_ready = asyncio.Event()
+_rag_init_task: asyncio.Task | None = None
+# How long chat requests arriving during startup wait for the index before returning 503
+RAG_READY_TIMEOUT_S = float(os.environ.get('RAG_READY_TIMEOUT_S', '30'))
+# Worker threads for blocking work (agent turns hold one for the whole LLM call). The asyncio
+# default of min(32, cpus + 4) caps a small instance at a handful of concurrent chats.
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', '64'))
+
+
+async def _initialize_rag():
+    global rag_system
+    try:
+        if rag_system is not None:
+            await asyncio.get_running_loop().run_in_executor(None, rag_system.initialize, str(ROOT_DIR / 'data'))
+            logging.info(f"RAG system initialized successfully with model: {rag_system.model_name}")
+    except Exception as e:
+        logging.error(f"Failed to initialize RAG system: {e}")
+        rag_system = None
+    finally:
+        _rag_ready.set()
+
+
+async def _wait_for_rag(timeout: float = 0.0) -> bool:
+    """True once the RAG system is ready; waits up to timeout seconds while it is still starting."""
+    if not _rag_ready.is_set() and timeout > 0:
+        try:
+            await asyncio.wait_for(_rag_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return _rag_ready.is_set() and rag_system is not None
+
 # Create the main app without a prefix
-app = FastAPI(redirect_slashes=False)
+# orjson encodes JSON responses in C (and handles datetimes natively)
+_JSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+app = FastAPI(redirect_slashes=False, default_response_class=_JSONResponse)
+
+
+@app.on_event("startup")
+async def _size_thread_pools():
+    # asyncio.to_thread (the agent, geo lookups) runs on the loop's default executor;
+    # FastAPI's sync endpoints and iterators use anyio's limiter
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix="server")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SERVER_THREADS
+
+
+@app.on_event("startup")
+async def _start_rag_initialization():
+    # Index loading/building and model init run in the background so uvicorn binds immediately
+    global _rag_init_task
+    _rag_init_task = asyncio.create_task(_initialize_rag())
 
-# Middleware to normalize trailing slashes (e.g., /api/chat/ -> /api/chat)
-class StripTrailingSlashMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        path = request.scope.get("path", "")
-        if len(path) > 1 and path.endswith("/"):
-            request.scope["path"] = path.rstrip("/")
-        return await call_next(request)
+# Middleware to normalize trailing slashes (e.g., /api/chat/ -> /api/chat).
+# Plain ASGI: BaseHTTPMiddleware would add a task and a memory stream to every request.
+class StripTrailingSlashMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope.get("path", "")
+            if len(path) > 1 and path.endswith("/"):
+                scope = {**scope, "path": path.rstrip("/")}
+        await self.app(scope, receive, send)
 
 app.add_middleware(StripTrailingSlashMiddleware)
 
+# Gzip text responses (analytics exports, history, chat JSON). Skipped for the NDJSON chat stream
+# (the compressor would hold back its deltas until enough bytes pile up) and the resume PDF
+# (already compressed, so gzip would only burn CPU on every download)
+_GZIP_SKIP_SUFFIXES = ("/chat/stream", "/resume")
+
+
+class GZipExceptStreamMiddleware:
+    def __init__(self, app, minimum_size: int = 500, compresslevel: int = 5):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].rstrip("/").endswith(_GZIP_SKIP_SUFFIXES):
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
+
+app.add_middleware(GZipExceptStreamMiddleware, minimum_size=500, compresslevel=5)
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api", redirect_slashes=False)
 
@@ -205,27 +335,46 @@ async def root():
     return {"message": "Portfolio API is running", "status": "healthy"}
 
 # Download resume
+_RESUME_PATH = str(ROOT_DIR / 'data' / 'resume.pdf')
+
 @api_router.get("/resume")
 async def download_resume():
-    resume_path = ROOT_DIR / 'data' / 'resume.pdf'
-    if not resume_path.exists():
+    # One stat per request: FileResponse reuses it instead of stat-ing again, and a replaced PDF is still picked up
+    try:
+        stat_result = os.stat(_RESUME_PATH)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Resume not found")
     return FileResponse(
-        path=str(resume_path),
+        path=_RESUME_PATH,
         filename="resume.pdf",
         media_type="application/pdf",
+        stat_result=stat_result,
     )
 
-# Chat endpoints
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, raw_request: Request):
-    """Chat with AI assistant about Tejas's portfolio"""
-    if not rag_system:
-        raise HTTPException(status_code=503, detail="RAG system not initialized. Please check OPENROUTER_API_KEY.")
-    
+def _warn_on_write_error(fut) -> None:
+    if fut.exception() is not None:
+        logger.warning(f"Session write failed: {fut.exception()}")
+
+
+async def _enrich_session_geo(session_id: str, ip: str, country_wins: bool) -> None:
+    """Background task: geolocate the client IP and fill the session's missing geo columns
+    (and, with country_wins, replace a header-derived country)."""
+    try:
+        geo = await _geo_from_ip(ip)
+        if geo:
+            queue_session_geo(session_id, geo, country_wins).add_done_callback(_warn_on_write_error)
+    except Exception as e:
+        logger.warning(f"Session geo enrichment failed: {e}")
+
+
+def _record_session(request: ChatRequest, raw_request: Request) -> None:
+    """Queue the session upsert with request metadata (best effort).
+    Server-side IP geolocation is not needed to answer, so it runs afterwards as a background task.
+    """
+    meta = request.meta
     # Respect Do Not Track if explicitly set
     dnt_header = raw_request.headers.get("DNT")
-    dnt = True if dnt_header == "1" else (request.meta.dnt if request.meta and request.meta.dnt is not None else False)
+    dnt = True if dnt_header == "1" else (meta.dnt if meta and meta.dnt is not None else False)
 
     # Upsert session row with metadata
     try:
@@ -237,87 +386,135 @@ async def chat(request: ChatRequest, raw_request: Request):
         net_org = raw_request.headers.get("x-as-org") or raw_request.headers.get("x-org")
         net_isp = raw_request.headers.get("x-isp")
 
-        # If we have a public IP and no client-provided precise geo, try server-side IP geolocation
-        precise_geo = {
-            'lat': request.meta.geo_lat if request.meta else None,
-            'lon': request.meta.geo_lon if request.meta else None,
-            'country': request.meta.geo_country if request.meta else None,
-            'region': request.meta.geo_region if request.meta else None,
-            'city': request.meta.geo_city if request.meta else None,
-        }
-        geo_from_ip = None
-        if client_host and not precise_geo['lat'] and not _is_private_ip(client_host):
-            geo_from_ip = _geo_from_ip(client_host)
+        # Client-provided precise geo wins. IP geolocation then fills what is still missing, except that
+        # its country beats the edge header's
+        precise_lat = meta.geo_lat if meta else None
+        precise_country = meta.geo_country if meta else None
 
-        ua = request.meta.user_agent if request.meta else raw_request.headers.get("User-Agent")
-        upsert_session(
+        ua = meta.user_agent if meta else raw_request.headers.get("User-Agent")
+        # Buffered like the messages (same single writer, so it lands before them)
+        fut = queue_session(
             session_id=request.session_id,
-            visitor_id=request.meta.visitor_id if request.meta else None,
-            ip=client_host,
+            visitor_id=meta.visitor_id if meta else None,
+            # Do Not Track visitors are stored without their address
+            ip=None if dnt else client_host,
             user_agent=ua,
-            locale=request.meta.locale if request.meta else None,
-            timezone_s=request.meta.timezone if request.meta else None,
-            referrer=request.meta.referrer if request.meta else None,
-            page_url=request.meta.page_url if request.meta else None,
+            locale=meta.locale if meta else None,
+            timezone_s=meta.timezone if meta else None,
+            referrer=meta.referrer if meta else None,
+            page_url=meta.page_url if meta else None,
             dnt=dnt,
             # Browser network hints
-            net_effective_type=request.meta.net_effective_type if request.meta else None,
-            net_downlink=request.meta.net_downlink if request.meta else None,
-            net_rtt=request.meta.net_rtt if request.meta else None,
-            net_save_data=request.meta.net_save_data if request.meta else None,
-            device_memory=request.meta.device_memory if request.meta else None,
+            net_effective_type=meta.net_effective_type if meta else None,
+            net_downlink=meta.net_downlink if meta else None,
+            net_rtt=meta.net_rtt if meta else None,
+            net_save_data=meta.net_save_data if meta else None,
+            device_memory=meta.device_memory if meta else None,
             # Geo/IP enrichment: prefer client-provided precise location if available, else headers
-            ip_plain=client_host,
-            geo_country=(precise_geo['country'] or (geo_from_ip or {}).get('country') or geo_country),
-            geo_region=(precise_geo['region'] or (geo_from_ip or {}).get('region')),
-            geo_city=(precise_geo['city'] or (geo_from_ip or {}).get('city')),
-            geo_lat=(precise_geo['lat'] or (geo_from_ip or {}).get('lat')),
-            geo_lon=(precise_geo['lon'] or (geo_from_ip or {}).get('lon')),
-            geo_timezone=(request.meta.timezone if request.meta else (geo_from_ip or {}).get('timezone')),
-            net_asn=(net_asn or (geo_from_ip or {}).get('asn')),
-            net_org=(net_org or (geo_from_ip or {}).get('org')),
-            net_isp=(net_isp or (geo_from_ip or {}).get('isp')),
+            ip_plain=None if dnt else client_host,
+            geo_country=precise_country or geo_country,
+            geo_region=meta.geo_region if meta else None,
+            geo_city=meta.geo_city if meta else None,
+            geo_lat=precise_lat,
+            geo_lon=meta.geo_lon if meta else None,
+            geo_timezone=(meta.timezone if meta else None),
+            net_asn=net_asn,
+            net_org=net_org,
+            net_isp=net_isp,
         )
+        fut.add_done_callback(_warn_on_write_error)
     except Exception as e:
         logger.warning(f"Session upsert failed: {e}")
+        return
+
+    # If we have a public IP and no client-provided precise geo, geolocate it off the request path
+    # (never for Do Not Track visitors)
+    if not dnt and client_host and not precise_lat and not _is_private_ip(client_host):
+        task = asyncio.create_task(_enrich_session_geo(request.session_id, client_host, not precise_country))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+# Conditional GETs: weak ETags from per-process counters; the boot id keeps tags issued by another
+# worker or an earlier process from ever matching
+_BOOT_ID = uuid.uuid4().hex[:8]
+# Session -> sequence number of its last queued message, least recently changed first and capped.
+# Sessions without an entry (never seen, or evicted) share _history_floor, the highest evicted number:
+# it is below every later change, so an evicted session can at worst miss a 304, never get a stale one.
+HISTORY_VERSIONS_MAX = int(os.environ.get('HISTORY_VERSIONS_MAX', '10000'))
+_history_versions: "OrderedDict[str, int]" = OrderedDict()
+_history_seq = 0
+_history_floor = 0
+_sources_version = 0
+
+
+def _queue_message(session_id: str, **fields) -> None:
+    """Queue a message for the DB and invalidate the session's history ETag."""
+    global _history_seq, _history_floor
+    queue_message(session_id=session_id, **fields)
+    # Bumped after queueing: fetch_history flushes the buffer, so a history read that saw this
+    # version also contains the message
+    _history_seq += 1
+    _history_versions[session_id] = _history_seq
+    _history_versions.move_to_end(session_id)
+    while len(_history_versions) > HISTORY_VERSIONS_MAX:
+        _, evicted = _history_versions.popitem(last=False)
+        _history_floor = max(_history_floor, evicted)
+
+
+def _not_modified(raw_request: Request, etag: str) -> bool:
+    header = raw_request.headers.get("if-none-match", "")
+    return etag in (t.strip() for t in header.split(","))
+
+
+def _log_assistant_message(session_id: str, response_text: str, start: datetime, end: datetime) -> None:
+    """Queue the assistant message with timing and retrieval diagnostics."""
+    duration_ms = int((end - start).total_seconds() * 1000)
+
+    # Extract diagnostics from agent
+    diags = rag_system.agent.get_last_diagnostics(session_id) if rag_system and rag_system.agent else {}
+    retrieved_sources = diags.get("retrieved_sources")
+    context_chars = diags.get("context_chars")
+    missing_info = diags.get("missing_info")
+
+    _queue_message(
+        session_id=session_id,
+        role="assistant",
+        content=response_text,
+        timestamp=int(end.timestamp() * 1000),
+        response_len=len(response_text or ""),
+        model_name=MODEL_NAME,
+        server_duration_ms=duration_ms,
+        missing_info=missing_info,
+        retrieved_sources=retrieved_sources,
+        context_chars=context_chars,
+    )
+
+
+# Chat endpoints
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, raw_request: Request):
+    """Chat with AI assistant about Tejas's portfolio"""
+    if not await _wait_for_rag(RAG_READY_TIMEOUT_S):
+        raise HTTPException(status_code=503, detail="RAG system not initialized. Please check OPENROUTER_API_KEY.")
+    
+    _record_session(request, raw_request)
 
     start = datetime.now(timezone.utc)
     try:
-        # Log user message
-        insert_message(
+        # Log user message (buffered; committed by the background batch writer)
+        _queue_message(
             session_id=request.session_id,
             role="user",
             content=request.message,
-            timestamp=start.isoformat(),
+            timestamp=int(start.timestamp() * 1000),
             message_len=len(request.message or ""),
         )
 
-        response_text = rag_system.chat(request.message, request.session_id)
+        response_text = await rag_system.achat(request.message, request.session_id)
 
         end = datetime.now(timezone.utc)
-        duration_ms = int((end - start).total_seconds() * 1000)
-
-        # Extract diagnostics from agent
-        diags = rag_system.agent.get_last_diagnostics(request.session_id) if rag_system and rag_system.agent else {}
-        retrieved_sources = diags.get("retrieved_sources")
-        context_chars = diags.get("context_chars")
-        missing_info = diags.get("missing_info")
-
-        # Store response_len and model name
-        model_name = os.environ.get('OPENROUTER_MODEL', 'openai/gpt-oss-20b:free')
-
-        insert_message(
-            session_id=request.session_id,
-            role="assistant",
-            content=response_text,
-            timestamp=end.isoformat(),
-            response_len=len(response_text or ""),
-            model_name=model_name,
-            server_duration_ms=duration_ms,
-            missing_info=missing_info,
-            retrieved_sources=retrieved_sources,
-            context_chars=context_chars,
-        )
+        _log_assistant_message(request.session_id, response_text, start, end)
 
         return ChatResponse(
             response=response_text,
@@ -330,15 +527,59 @@ async def chat(request: ChatRequest, raw_request: Request):
         logger.error(f"Error in chat endpoint: {e}\n{tb}")
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+@api_router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, raw_request: Request):
+    """Chat with the answer streamed as NDJSON: {"delta": ...} lines ({"reset": true} discards them), then the final ChatResponse"""
+    if not await _wait_for_rag(RAG_READY_TIMEOUT_S):
+        raise HTTPException(status_code=503, detail="RAG system not initialized. Please check OPENROUTER_API_KEY.")
+
+    _record_session(request, raw_request)
+
+    start = datetime.now(timezone.utc)
+    _queue_message(
+        session_id=request.session_id,
+        role="user",
+        content=request.message,
+        timestamp=int(start.timestamp() * 1000),
+        message_len=len(request.message or ""),
+    )
+
+    async def events():
+        try:
+            async for kind, text in rag_system.achat_stream(request.message, request.session_id):
+                if kind == "delta":
+                    yield json.dumps({"delta": text}) + "\n"
+                    continue
+                if kind == "reset":
+                    # The streaming model failed; the final reply comes from a fallback model
+                    yield json.dumps({"reset": True}) + "\n"
+                    continue
+                end = datetime.now(timezone.utc)
+                _log_assistant_message(request.session_id, text, start, end)
+                # The final reply is post-processed and may differ slightly from the streamed text
+                yield ChatResponse(response=text, session_id=request.session_id, timestamp=end).model_dump_json() + "\n"
+        except Exception as e:
+            import traceback
+            tb = traceback.format_exc()
+            logger.error(f"Error in chat stream endpoint: {e}\n{tb}")
+            yield json.dumps({"error": f"Error processing chat: {str(e)}"}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Get chat history for a session"""
-    if not rag_system:
+async def get_chat_history(session_id: str, raw_request: Request):
+    """Get chat history for a session (304 when the client's ETag is current)"""
+    if not await _wait_for_rag():
         raise HTTPException(status_code=503, detail="RAG system not initialized.")
-    
+
+    # Read the version before the history so the tag never runs ahead of the content
+    etag = f'W/"{_BOOT_ID}-{_history_versions.get(session_id, _history_floor)}"'
+    if _not_modified(raw_request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     try:
-        history = rag_system.get_history(session_id)
-        return {"session_id": session_id, "messages": history}
+        # fetch_history waits for the buffered writer to drain, so keep it off the event loop
+        history = await asyncio.to_thread(rag_system.get_history, session_id)
+        return _JSONResponse({"session_id": session_id, "messages": history}, headers={"ETag": etag})
     except Exception as e:
         logger.error(f"Error getting chat history: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting history: {str(e)}")
@@ -347,7 +588,7 @@ async def get_chat_history(session_id: str):
 async def debug_geo(ip: str):
     """Debug endpoint to test server-side geolocation."""
     try:
-        res = _geo_from_ip(ip)
+        res = await _geo_from_ip(ip)
         return {"ip": ip, "geo": res}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Geo debug failed: {e}")
@@ -355,7 +596,7 @@ async def debug_geo(ip: str):
 @api_router.get("/debug/openrouter")
 async def debug_openrouter():
     """Call OpenRouter with the configured model and return raw response."""
-    if not rag_system:
+    if not await _wait_for_rag():
         raise HTTPException(status_code=503, detail="RAG system not initialized.")
     model = os.environ.get('OPENROUTER_MODEL', 'deepseek/deepseek-chat-v3.1:free')
     key = os.environ.get('OPENROUTER_API_KEY')
@@ -376,7 +617,8 @@ async def debug_openrouter():
         "max_tokens": 50,
     }
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=60)
+        # Blocking I/O runs in a worker thread so the event loop keeps serving other requests
+        resp = await asyncio.to_thread(_debug_http.post, url, headers=headers, json=payload, timeout=60)
         return {
             "model": model,
             "status": resp.status_code,
@@ -391,23 +633,28 @@ async def debug_openrouter():
 @api_router.post("/rag/reindex")
 async def rag_reindex():
     """Force reindex of the data directory."""
-    if not rag_system:
+    if not await _wait_for_rag():
         raise HTTPException(status_code=503, detail="RAG system not initialized.")
     try:
         data_dir = ROOT_DIR / 'data'
+        global _sources_version
         rag_system.reindex(str(data_dir))
+        _sources_version += 1
         return {"status": "reindexed", "summary": rag_system.get_sources_summary()}
     except Exception as e:
         logger.error(f"Error reindexing: {e}")
         raise HTTPException(status_code=500, detail=f"Error reindexing: {str(e)}")
 
 @api_router.get("/rag/sources")
-async def rag_sources():
-    """Summary of indexed sources"""
-    if not rag_system:
+async def rag_sources(raw_request: Request):
+    """Summary of indexed sources (304 when the client's ETag is current)"""
+    if not await _wait_for_rag():
         raise HTTPException(status_code=503, detail="RAG system not initialized.")
+    etag = f'W/"{_BOOT_ID}-src-{_sources_version}"'
+    if _not_modified(raw_request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     try:
-        return rag_system.get_sources_summary()
+        return _JSONResponse(rag_system.get_sources_summary(), headers={"ETag": etag})
     except Exception as e:
         logger.error(f"Error getting sources: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting sources: {str(e)}")
@@ -419,46 +666,57 @@ async def download_analytics(days: int = 30, limit: int = 1000, format: str = "j
     - format=csv: simple CSV
     """
     try:
-        rows = fetch_analytics_sessions(days=days, limit=limit)
+        # The snapshot refresh flushes the buffered writer and copies new rows; run it in a worker thread
+        rows = await asyncio.to_thread(fetch_analytics_sessions, days=days, limit=limit)
 
+        # Rows are serialized as the response is sent, so memory stays flat however large the export
         if format == "csv":
             import csv
             from io import StringIO
-            buf = StringIO()
-            writer = csv.writer(buf)
-            header = [
-                "session_id", "visitor_id", "ip", "country", "region", "city", "lat", "lon", "duration_seconds", "updated_at"
-            ]
-            writer.writerow(header)
-            for r in rows:
-                writer.writerow([
-                    r.get("session_id"), r.get("visitor_id"), r.get("ip_plain"), r.get("geo_country"), r.get("geo_region"), r.get("geo_city"),
-                    r.get("geo_lat"), r.get("geo_lon"), r.get("duration_seconds"), r.get("updated_at")
-                ])
-            buf.seek(0)
+
+            def iter_rows():
+                buf = StringIO()
+                writer = csv.writer(buf)
+                header = [
+                    "session_id", "visitor_id", "ip", "country", "region", "city", "lat", "lon", "duration_seconds", "updated_at"
+                ]
+                writer.writerow(header)
+                yield buf.getvalue()
+                for r in rows:
+                    buf.seek(0)
+                    buf.truncate(0)
+                    writer.writerow([
+                        r.get("session_id"), r.get("visitor_id"), r.get("ip_plain"), r.get("geo_country"), r.get("geo_region"), r.get("geo_city"),
+                        r.get("geo_lat"), r.get("geo_lon"), r.get("duration_seconds"), r.get("updated_at")
+                    ])
+                    yield buf.getvalue()
+
             filename = f"analytics_{days}d_sessions.csv"
-            return StreamingResponse(buf, media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
+            return StreamingResponse(iter_rows(), media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
         else:
-            from io import StringIO
-            buf = StringIO()
-            for r in rows:
-                # Emit only the requested fields
-                out = {
-                    "session_id": r.get("session_id"),
-                    "visitor_id": r.get("visitor_id"),
-                    "ip": r.get("ip_plain"),
-                    "country": r.get("geo_country"),
-                    "region": r.get("geo_region"),
-                    "city": r.get("geo_city"),
-                    "lat": r.get("geo_lat"),
-                    "lon": r.get("geo_lon"),
-                    "duration_seconds": r.get("duration_seconds"),
-                    "updated_at": r.get("updated_at"),
-                }
-                buf.write(json.dumps(out, ensure_ascii=False) + "\n")
-            buf.seek(0)
+            def iter_rows():
+                for r in rows:
+                    # Emit only the requested fields
+                    out = {
+                        "session_id": r.get("session_id"),
+                        "visitor_id": r.get("visitor_id"),
+                        "ip": r.get("ip_plain"),
+                        "country": r.get("geo_country"),
+                        "region": r.get("geo_region"),
+                        "city": r.get("geo_city"),
+                        "lat": r.get("geo_lat"),
+                        "lon": r.get("geo_lon"),
+                        "duration_seconds": r.get("duration_seconds"),
+                        "updated_at": r.get("updated_at"),
+                    }
+                    if orjson is not None:
+                        # UTF-8 bytes straight from C; the fallback below uses the same compact, non-ASCII-escaping layout
+                        yield orjson.dumps(out) + b"\n"
+                    else:
+                        yield json.dumps(out, ensure_ascii=False, separators=(",", ":")) + "\n"
+
             filename = f"analytics_{days}d_sessions.jsonl"
-            return StreamingResponse(buf, media_type="application/x-ndjson", headers={"Content-Disposition": f"attachment; filename={filename}"})
+            return StreamingResponse(iter_rows(), media_type="application/x-ndjson", headers={"Content-Disposition": f"attachment; filename={filename}"})
     except Exception as e:
         logger.error(f"Error generating analytics download: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating analytics: {e}")
@@ -472,9 +730,8 @@ def root_ok():
 app.include_router(api_router)
 
 _origins_raw = os.environ.get('CORS_ORIGINS', '')
-_origins = [o.strip() for o in _origins_raw.split(',') if o.strip()]
-if not _origins:
-    _origins = ["*"]
+# A frozenset: CORSMiddleware only tests membership, so each Origin check is O(1)
+_origins = frozenset(o.strip() for o in _origins_raw.split(',') if o.strip()) or frozenset(("*",))
 _allow_creds = False if "*" in _origins else True
 
 app.add_middleware(
@@ -485,4 +742,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# No shutdown hooks required currently
+@app.on_event("shutdown")
+def _close_http_sessions():
+    _debug_http.close()
+    _geo_http.close()
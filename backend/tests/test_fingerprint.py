@@ -0,0 +1,41 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import db  # noqa: E402
+from rag.init_rag import RAGSystem  # noqa: E402
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._tmp.name)
+        (self.data_dir / "profile.yaml").write_text("name: Test\n")
+        (self.data_dir / "notes.md").write_text("# Notes\n")
+        # The app's SQLite files live next to the data files, as in backend/data
+        db.init_db(str(self.data_dir / "app.db"))
+        self.rag = RAGSystem()
+
+    def tearDown(self):
+        db._close_conns()
+        self._tmp.cleanup()
+
+    def test_db_write_keeps_fingerprint(self):
+        before = self.rag._fingerprint(self.data_dir)
+        db.upsert_session("s1", ip="203.0.113.7")
+        db.insert_message("s1", "user", "hello")
+        db.refresh_analytics_snapshot(force=True)
+        self.assertTrue(any(p.name.startswith("app.db") for p in self.data_dir.iterdir()))
+        self.assertEqual(before, self.rag._fingerprint(self.data_dir))
+
+    def test_data_edit_changes_fingerprint(self):
+        before = self.rag._fingerprint(self.data_dir)
+        (self.data_dir / "notes.md").write_text("# Notes\nMore.\n")
+        self.assertNotEqual(before, self.rag._fingerprint(self.data_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rag import agent  # noqa: E402
+
+
+def _answer(text):
+    return '{"answer": "%s"}' % text, {"answer": text}
+
+
+def _make_agent(calls):
+    """A RAGAgent with only what generate_response reads; calls maps model -> fake attempt."""
+    rag = agent.RAGAgent.__new__(agent.RAGAgent)
+    rag.session_flags = {}
+    rag.session_diagnostics = {}
+    rag._system_instructions = {False: "", True: ""}
+    rag._schema_prompt = ""
+    rag._headers = {}
+    rag._candidates = list(calls)
+    rag._encode_query = lambda text: None
+    rag._lookup_response = lambda key_vec, ent_flag: None
+    rag._note_entertainment = lambda session_id, ent_flag, text: None
+
+    def call_model(model, headers, prompt_messages, cancel, on_delta=None, first_delta=None):
+        return calls[model](on_delta, first_delta)
+    rag._call_model = call_model
+    return rag
+
+
+class HedgedStreamTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(agent, "HEDGE_DELAY_S", 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hedge_started = threading.Event()
+        self.hedge_done = threading.Event()
+        self.claimed = threading.Event()
+
+    def _run(self, calls):
+        deltas, resets = [], []
+        state = {"messages": [], "session_id": "s1", "question": "Where?", "transcript": ""}
+        state = _make_agent(calls).generate_response(state, deltas.append, lambda: resets.append(True))
+        return state["reply"].content, deltas, resets
+
+    def _hedge(self, on_delta, first_delta):
+        # Fires after the primary stayed silent; finishes first, without holding the stream
+        self.hedge_started.set()
+        self.claimed.wait(5)
+        first_delta.set()
+        on_delta("Berlin")
+        self.hedge_done.set()
+        return _answer("Berlin")
+
+    def test_streaming_model_answers_even_when_it_finishes_last(self):
+        def primary(on_delta, first_delta):
+            self.hedge_started.wait(5)
+            first_delta.set()
+            on_delta("Pune")
+            self.claimed.set()
+            self.hedge_done.wait(5)
+            time.sleep(0.05)
+            return _answer("Pune")
+
+        reply, deltas, resets = self._run({"primary": primary, "hedge": self._hedge})
+        self.assertEqual(reply, "Pune")
+        self.assertEqual(deltas, ["Pune"])
+        self.assertEqual(resets, [])
+
+    def test_failed_streaming_model_resets_and_falls_back(self):
+        def primary(on_delta, first_delta):
+            self.hedge_started.wait(5)
+            first_delta.set()
+            on_delta("Pu")
+            self.claimed.set()
+            self.hedge_done.wait(5)
+            time.sleep(0.05)
+            raise RuntimeError("stream error")
+
+        reply, deltas, resets = self._run({"primary": primary, "hedge": self._hedge})
+        self.assertEqual(reply, "Berlin")
+        self.assertEqual(deltas, ["Pu"])
+        self.assertEqual(resets, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()